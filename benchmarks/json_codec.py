@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Compares the stdlib json module and orjson decoding and encoding Abiquo
+# collection payloads similar to the ones returned for templates, VDCs and
+# enterprises.
+#
+#   python benchmarks/json_codec.py [--entities 5000] [--rounds 5]
+
+import argparse
+import json
+import time
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+API = 'https://abiquo.example.com/api'
+
+
+def link(rel, path, media_type, title=None):
+    lnk = {'rel': rel, 'href': '%s/%s' % (API, path), 'type': 'application/vnd.abiquo.%s+json' % media_type}
+    if title is not None:
+        lnk['title'] = title
+    return lnk
+
+
+def template(i):
+    path = 'admin/enterprises/1/datacenterrepositories/2/virtualmachinetemplates/%d' % i
+    return {
+        'id': i,
+        'name': 'template-%d' % i,
+        'description': 'Golden image number %d' % i,
+        'cpuRequired': 1,
+        'ramRequired': 1024,
+        'diskFormatType': 'VMDK_STREAM_OPTIMIZED',
+        'diskFileSize': 1073741824,
+        'state': 'DONE',
+        'guestSetup': 'CLOUD_INIT',
+        'creationDate': '2019-01-01T00:00:00+0000',
+        'links': [
+            link('edit', path, 'virtualmachinetemplate', 'template-%d' % i),
+            link('enterprise', 'admin/enterprises/1', 'enterprise', 'Abiquo'),
+            link('datacenterrepository', 'admin/enterprises/1/datacenterrepositories/2', 'datacenterrepository'),
+            link('category', 'config/categories/1', 'category', 'Others'),
+            link('icon', 'config/icons/1', 'icon'),
+            link('disk0', path + '/disks/%d' % i, 'harddisk'),
+            link('disks', path + '/disks', 'harddisks'),
+            link('conversions', path + '/conversions', 'conversions'),
+            link('tasks', path + '/tasks', 'tasks'),
+            link('datacenter', 'admin/datacenters/2', 'datacenter', 'dc-2'),
+        ],
+    }
+
+
+def vdc(i):
+    path = 'cloud/virtualdatacenters/%d' % i
+    return {
+        'id': i,
+        'name': 'vdc-%d' % i,
+        'hypervisorType': 'KVM',
+        'vlansLimit': {'soft': 0, 'hard': 0},
+        'links': [
+            link('edit', path, 'virtualdatacenter', 'vdc-%d' % i),
+            link('location', 'cloud/locations/2', 'datacenter', 'dc-2'),
+            link('enterprise', 'admin/enterprises/1', 'enterprise', 'Abiquo'),
+            link('virtualappliances', path + '/virtualappliances', 'virtualappliances'),
+            link('privatenetworks', path + '/privatenetworks', 'vlans'),
+            link('templates', path + '/action/templates', 'virtualmachinetemplates'),
+            link('tiers', path + '/tiers', 'tiers'),
+            link('volumes', path + '/volumes', 'volumes'),
+        ],
+    }
+
+
+def enterprise(i):
+    path = 'admin/enterprises/%d' % i
+    return {
+        'id': i,
+        'name': 'enterprise-%d' % i,
+        'isReservationRestricted': False,
+        'ramSoft': 0, 'ramHard': 0, 'cpuCountSoft': 0, 'cpuCountHard': 0,
+        'links': [
+            link('edit', path, 'enterprise', 'enterprise-%d' % i),
+            link('users', path + '/users', 'users'),
+            link('limits', path + '/limits', 'limits'),
+            link('datacenterrepositories', path + '/datacenterrepositories', 'datacenterrepositories'),
+            link('properties', path + '/properties', 'enterpriseproperties'),
+            link('pricingtemplate', 'config/pricingtemplates/1', 'pricingtemplate'),
+        ],
+    }
+
+
+def collection(factory, size):
+    return {'links': [], 'totalSize': size, 'collection': [factory(i) for i in range(size)]}
+
+
+def measure(func, rounds):
+    best = None
+    for i in range(rounds):
+        start = time.time()
+        func()
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--entities', type=int, default=5000)
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args()
+
+    codecs = [('json', lambda d: json.loads(d), lambda o: json.dumps(o).encode('utf-8'))]
+    if orjson is not None:
+        codecs.append(('orjson', orjson.loads, orjson.dumps))
+    else:
+        print('orjson is not installed, only the stdlib codec is measured')
+
+    print('%-12s %-8s %10s %12s %12s' % ('payload', 'codec', 'size (KB)', 'loads (ms)', 'dumps (ms)'))
+    for name, factory in [('templates', template), ('vdcs', vdc), ('enterprises', enterprise)]:
+        payload = collection(factory, args.entities)
+        raw = json.dumps(payload).encode('utf-8')
+        for codec, loads, dumps in codecs:
+            load_time = measure(lambda: loads(raw), args.rounds)
+            dump_time = measure(lambda: dumps(payload), args.rounds)
+            print('%-12s %-8s %10d %12.1f %12.1f' %
+                  (name, codec, len(raw) / 1024, load_time * 1000, dump_time * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright: Ansible Project
+# GNU General Public License v3.0+ (see COPYING or
+# https://www.gnu.org/licenses/gpl-3.0.txt)
+
+
+class ModuleDocFragment(object):
+
+    # Options of the facts modules handled by module_utils/abiquo/facts.py
+    DOCUMENTATION = '''
+options:
+    fields:
+        description:
+          - Fields to return for each entity, the whole entity is returned if not set.
+          - Nested values are selected with dots. For links, the rel selects which links to keep, e.g. 'links.edit' or 'links.edit.href'.
+        required: False
+        default: null
+    output_format:
+        description:
+          - Layout of the returned entities. 'list' returns a list of dicts.
+          - With 'columnar', a dict is returned with 'columns', 'rows' (one list of values per entity) and 'links', a table of the distinct links that the rows reference by index.
+        required: False
+        choices: ["list", "columnar"]
+        default: "list"
+    output_file:
+        description:
+          - If set, the entities are written to this file as they are read, one JSON document per line (NDJSON), instead of being returned.
+          - The result then contains an 'output_file' dict with the 'path', the 'count' of entities and the SHA-256 'checksum' of the file.
+        required: False
+        default: null
+    output_compress:
+        description:
+          - Whether to gzip the output_file.
+        required: False
+        default: False
+    since_state:
+        description:
+          - Path of a state file holding a snapshot of the entities returned by the previous run.
+          - If set, only the entities added or changed since that snapshot are returned, and a 'delta' dict lists the hrefs of the 'added', 'changed' and 'removed' entities. The snapshot is then replaced with the current one.
+          - Changes are detected on the selected 'fields' only. Use one state file per query, entities filtered out by the query are reported as removed.
+        required: False
+        default: null
+    expand:
+        description:
+          - Rels of the links to resolve, e.g. 'hardwareprofile' or 'virtualmachinetemplate'.
+          - The linked entities are fetched concurrently, and each distinct href only once however many entities link to it.
+        required: False
+        default: null
+    expand_mode:
+        description:
+          - How the expanded entities are returned. 'table' returns an 'expanded' dict with the entities keyed by href.
+          - With 'embed', an 'expanded' dict is added to each entity with the linked entities keyed by rel.
+        required: False
+        choices: ["table", "embed"]
+        default: "table"
+'''
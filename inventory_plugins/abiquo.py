@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+
+# Copyright: Ansible Project
+# GNU General Public License v3.0+ (see COPYING or
+# https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+DOCUMENTATION = '''
+    name: abiquo
+    plugin_type: inventory
+    short_description: Abiquo virtual machines inventory source
+    description:
+        - Gets the virtual machines of the virtual datacenters visible to the user from the Abiquo API.
+        - VDCs, vApps and VMs are listed concurrently, the concurrency adapts to the API latency.
+        - Hosts are grouped by VDC (vdc_<name>), vApp (vapp_<name>), state (state_<state>) and tags (tag_<key>_<value>).
+        - The configuration file name must end with 'abiquo.yml' or 'abiquo.yaml'.
+    requirements:
+        - "abiquo-api >= 0.1.13"
+    extends_documentation_fragment:
+        - constructed
+        - inventory_cache
+    options:
+        plugin:
+            description: Token that ensures this is a source file for the 'abiquo' plugin.
+            required: True
+            choices: ['abiquo']
+        api_url:
+            description: Abiquo API endpoint URL.
+            env:
+                - name: ABIQUO_API_URL
+        api_user:
+            description: API username.
+            env:
+                - name: ABIQUO_API_USERNAME
+        api_pass:
+            description: API password.
+            env:
+                - name: ABIQUO_API_PASSWORD
+        app_key:
+            description: OAuth1 application key.
+            env:
+                - name: ABIQUO_API_APP_KEY
+        app_secret:
+            description: OAuth1 application secret.
+            env:
+                - name: ABIQUO_API_APP_SECRET
+        token:
+            description: OAuth1 token.
+            env:
+                - name: ABIQUO_API_TOKEN
+        token_secret:
+            description: OAuth1 token secret.
+            env:
+                - name: ABIQUO_API_TOKEN_SECRET
+        verify:
+            description: Whether or not to verify SSL certificates.
+            type: bool
+            default: True
+        vdcs:
+            description: Names of the virtual datacenters to include. All of them if not set.
+            type: list
+            default: []
+        hostnames:
+            description:
+                - VM attribute used as inventory hostname.
+                - When two VMs share a label, the second one is added with its name.
+            choices: ['label', 'name']
+            default: label
+        with_tags:
+            description: Whether to fetch the tags of every VM to group them and expose them as 'abiquo_tags'.
+            type: bool
+            default: True
+        max_concurrency:
+            description: Upper bound for concurrent API requests.
+            type: int
+            default: 16
+        refresh_interval:
+            description:
+                - Only used with the inventory cache. When greater than 0, cached VDCs fetched more than this
+                  number of seconds ago are fetched again on the next run while the others are served from the
+                  cache, so the cost of keeping a large inventory up to date is spread across runs.
+                - With 0, the cached inventory is used as is until the cache expires.
+            type: int
+            default: 0
+'''
+
+EXAMPLES = '''
+# abiquo.yml
+plugin: abiquo
+api_url: https://abiquo.example.com/api
+api_user: admin
+api_pass: xabiquo
+vdcs:
+  - production
+cache: true
+cache_plugin: jsonfile
+cache_connection: /tmp/abiquo_inventory
+cache_timeout: 86400
+refresh_interval: 900
+keyed_groups:
+  - key: abiquo_tags.app
+    prefix: app
+'''
+
+import os
+import time
+
+from ansible.errors import AnsibleError
+from ansible.inventory.group import to_safe_group_name
+from ansible.plugins.inventory import BaseInventoryPlugin, Cacheable, Constructable
+
+import ansible.module_utils
+# The module_utils shipped with this role are only added to the module
+# payloads, make them importable from the controller too.
+ROLE_MODULE_UTILS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'module_utils')
+if ROLE_MODULE_UTILS not in ansible.module_utils.__path__:
+    ansible.module_utils.__path__.append(ROLE_MODULE_UTILS)
+
+from ansible.module_utils.abiquo.common import AbiquoCommon
+from ansible.module_utils.abiquo import tag as tag_module
+
+
+class PluginParams(object):
+    def __init__(self, params):
+        self.params = params
+
+
+class InventoryModule(BaseInventoryPlugin, Constructable, Cacheable):
+
+    NAME = 'abiquo'
+
+    def verify_file(self, path):
+        return super(InventoryModule, self).verify_file(path) and \
+            path.endswith(('abiquo.yml', 'abiquo.yaml'))
+
+    def parse(self, inventory, loader, path, cache=True):
+        super(InventoryModule, self).parse(inventory, loader, path, cache)
+        self._read_config_data(path)
+
+        cache_key = self.get_cache_key(path)
+        use_cache = self.get_option('cache')
+
+        previous = {}
+        if use_cache and cache:
+            try:
+                previous = self._cache[cache_key]
+            except KeyError:
+                pass
+
+        # An empty inventory is never fresh, new VDCs would not be looked for
+        if previous.get('vdcs') and all(self._is_fresh(vdc) for vdc in previous['vdcs'].values()):
+            data = previous
+        else:
+            data = self._refresh(previous)
+            if use_cache:
+                self._cache[cache_key] = data
+
+        self._populate(data)
+
+    def _is_fresh(self, vdc):
+        interval = self.get_option('refresh_interval')
+        return interval <= 0 or time.time() - vdc['fetched_at'] < interval
+
+    def _common(self):
+        try:
+            return AbiquoCommon(PluginParams({
+                'abiquo_api_url': self.get_option('api_url'),
+                'abiquo_api_user': self.get_option('api_user'),
+                'abiquo_api_pass': self.get_option('api_pass'),
+                'abiquo_app_key': self.get_option('app_key'),
+                'abiquo_app_secret': self.get_option('app_secret'),
+                'abiquo_token': self.get_option('token'),
+                'abiquo_token_secret': self.get_option('token_secret'),
+                'abiquo_verify': self.get_option('verify'),
+                'abiquo_max_concurrency': self.get_option('max_concurrency'),
+            }))
+        except ValueError as ex:
+            raise AnsibleError(str(ex))
+
+    def _bulk(self, common, func, items, what):
+        values = []
+        for item, (ok, value) in zip(items, common.bulk_map(func, items)):
+            if not ok:
+                raise AnsibleError('Failed to get %s: %s' % (what(item), value))
+            values.append(value)
+        return values
+
+    def _refresh(self, previous):
+        common = self._common()
+        wanted = self.get_option('vdcs')
+
+        data = {'vdcs': {}}
+        stale = []
+        for vdc in common.client.cloud.virtualdatacenters.iter_collection(
+                headers={'Accept': 'application/vnd.abiquo.virtualdatacenters+json'}):
+            if wanted and vdc.name not in wanted:
+                continue
+            href = vdc._extract_link('edit')['href']
+            cached = previous.get('vdcs', {}).get(href)
+            if cached is not None and self._is_fresh(cached):
+                data['vdcs'][href] = cached
+            else:
+                stale.append(vdc)
+
+        # One level at a time, so each level is fetched with a single pool
+        vapps_by_vdc = self._bulk(common, lambda vdc: list(vdc.follow('virtualappliances').iter_collection()),
+                                  stale, lambda vdc: "the vApps of VDC '%s'" % vdc.name)
+        vapps = [(vdc, vapp) for vdc, vdc_vapps in zip(stale, vapps_by_vdc) for vapp in vdc_vapps]
+
+        vms_by_vapp = self._bulk(common, lambda entry: list(entry[1].follow('virtualmachines').iter_collection()),
+                                 vapps, lambda entry: "the VMs of vApp '%s'" % entry[1].name)
+        vms = [(vdc, vapp, vm) for (vdc, vapp), vapp_vms in zip(vapps, vms_by_vapp) for vm in vapp_vms]
+
+        tags = [{} for vm in vms]
+        if self.get_option('with_tags'):
+            tags = self._bulk(common, lambda entry: tag_module.get_tags(entry[2]),
+                              vms, lambda entry: "the tags of VM '%s'" % entry[2].label)
+
+        now = time.time()
+        for vdc in stale:
+            data['vdcs'][vdc._extract_link('edit')['href']] = {'name': vdc.name, 'fetched_at': now, 'vms': []}
+        for (vdc, vapp, vm), vm_tags in zip(vms, tags):
+            data['vdcs'][vdc._extract_link('edit')['href']]['vms'].append(
+                self._host_vars(vdc, vapp, vm, vm_tags))
+
+        return data
+
+    def _host_vars(self, vdc, vapp, vm, tags):
+        host_vars = {
+            'abiquo_id': vm.id,
+            'abiquo_name': vm.name,
+            'abiquo_label': vm.label,
+            'abiquo_state': vm.json.get('state'),
+            'abiquo_vdc': vdc.name,
+            'abiquo_vapp': vapp.name,
+            'abiquo_tags': tags,
+            'abiquo_link': vm._extract_link('edit')['href'],
+        }
+        nic = vm._extract_link('nic0')
+        if nic is not None and nic.get('title'):
+            host_vars['ansible_host'] = nic['title']
+        return host_vars
+
+    def _populate(self, data):
+        strict = self.get_option('strict')
+        hostname_key = 'abiquo_%s' % self.get_option('hostnames')
+
+        for vdc in data['vdcs'].values():
+            for host_vars in vdc['vms']:
+                host = host_vars[hostname_key]
+                if host in self.inventory.hosts:
+                    host = host_vars['abiquo_name']
+                self.inventory.add_host(host)
+
+                groups = ['vdc_%s' % host_vars['abiquo_vdc'],
+                          'vapp_%s' % host_vars['abiquo_vapp']]
+                if host_vars['abiquo_state']:
+                    groups.append('state_%s' % host_vars['abiquo_state'].lower())
+                for key, value in host_vars['abiquo_tags'].items():
+                    groups.append('tag_%s_%s' % (key, value))
+                for group in groups:
+                    group = self.inventory.add_group(to_safe_group_name(group))
+                    self.inventory.add_child(group, host)
+
+                for key, value in host_vars.items():
+                    self.inventory.set_variable(host, key, value)
+
+                self._set_composite_vars(self.get_option('compose'), host_vars, host, strict=strict)
+                self._add_host_to_composed_groups(self.get_option('groups'), host_vars, host, strict=strict)
+                self._add_host_to_keyed_groups(self.get_option('keyed_groups'), host_vars, host, strict=strict)
@@ -9,6 +9,8 @@ import json
 import traceback
 from ansible.module_utils.abiquo.common import abiquo_argument_spec
 from ansible.module_utils.abiquo.common import AbiquoCommon
+from ansible.module_utils.abiquo.facts import FactsCollector
+from ansible.module_utils.abiquo.facts import facts_argument_spec
 from ansible.module_utils._text import to_native
 from ansible.module_utils.basic import AnsibleModule
 ANSIBLE_METADATA = {'metadata_version': '0.1',
@@ -77,6 +79,7 @@ options:
           - Expression to apply to the results for further filtering
         required: False
         default: null
+extends_documentation_fragment: abiquo_facts
 '''
 
 EXAMPLES = '''
@@ -100,26 +103,20 @@ def core(module):
         module.fail_json(msg=ex.message)
     api = common.client
 
+    predicate = eval(expression) if expression is not None else None
+    collector = FactsCollector(module, common)
     try:
-        c, currencies = api.config.currencies.get(
-            headers={'Accept': 'application/vnd.abiquo.currencies+json'},
-            params=params
-        )
-        common.check_response(200, c, currencies)
+        for currency in api.config.currencies.iter_collection(
+                headers={'Accept': 'application/vnd.abiquo.currencies+json'},
+                params=params):
+            j = currency.json
+            j['currency_link'] = currency._extract_link('edit')
+            if predicate is None or predicate(j):
+                collector.add(j)
     except Exception as ex:
         module.fail_json(msg=ex.message)
 
-    all_currencies = []
-    for currency in currencies:
-        j = currency.json
-        j['currency_link'] = currency._extract_link('edit')
-        all_currencies.append(j)
-
-    if expression is not None:
-        r = filter(eval(expression), all_currencies)
-        module.exit_json(currencies=r)
-    else:
-        module.exit_json(currencies=all_currencies)
+    collector.exit_json('currencies')
 
 
 def main():
@@ -128,6 +125,7 @@ def main():
         params=dict(default=None, required=False, type='dict'),
         expression=dict(default=None, required=False)
     )
+    arg_spec.update(facts_argument_spec())
     module = AnsibleModule(
         argument_spec=arg_spec
     )
@@ -9,6 +9,8 @@ import json
 import traceback
 from ansible.module_utils.abiquo.common import abiquo_argument_spec
 from ansible.module_utils.abiquo.common import AbiquoCommon
+from ansible.module_utils.abiquo.facts import FactsCollector
+from ansible.module_utils.abiquo.facts import facts_argument_spec
 from ansible.module_utils._text import to_native
 from ansible.module_utils.basic import AnsibleModule
 ANSIBLE_METADATA = {'metadata_version': '0.1',
@@ -77,6 +79,7 @@ options:
           - Expression to apply to the results for further filtering
         required: False
         default: null
+extends_documentation_fragment: abiquo_facts
 '''
 
 EXAMPLES = '''
@@ -109,20 +112,18 @@ def core(module):
         module.fail_json(msg=ex.message)
     api = common.client
 
+    predicate = eval(expression) if expression is not None else None
+    collector = FactsCollector(module, common)
     try:
-        c, datacenters = api.admin.datacenters.get(
-            headers={'Accept': 'application/vnd.abiquo.datacenters+json'},
-            params=params
-        )
-        common.check_response(200, c, datacenters)
+        for dc in api.admin.datacenters.iter_collection(
+                headers={'Accept': 'application/vnd.abiquo.datacenters+json'},
+                params=params):
+            if predicate is None or predicate(dc):
+                collector.add(dc.json)
     except Exception as ex:
         module.fail_json(msg=ex.message)
 
-    if expression is not None:
-        dcs = filter(eval(expression), datacenters)
-        module.exit_json(dcs=map(lambda x: x.json, dcs))
-    else:
-        module.exit_json(dcs=datacenters.collection)
+    collector.exit_json('dcs')
 
 
 def main():
@@ -131,6 +132,7 @@ def main():
         params=dict(default=None, required=False, type='dict'),
         expression=dict(default=None, required=False)
     )
+    arg_spec.update(facts_argument_spec())
     module = AnsibleModule(
         argument_spec=arg_spec
     )
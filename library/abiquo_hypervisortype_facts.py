@@ -10,6 +10,8 @@ import traceback
 from ansible.module_utils.abiquo import hypervisortype as htype_module
 from ansible.module_utils.abiquo.common import abiquo_argument_spec
 from ansible.module_utils.abiquo.common import AbiquoCommon
+from ansible.module_utils.abiquo.facts import FactsCollector
+from ansible.module_utils.abiquo.facts import facts_argument_spec
 from ansible.module_utils._text import to_native
 from ansible.module_utils.basic import AnsibleModule
 ANSIBLE_METADATA = {'metadata_version': '0.1',
@@ -73,6 +75,7 @@ options:
           - Expression to apply to the results for further filtering
         required: False
         default: null
+extends_documentation_fragment: abiquo_facts
 '''
 
 EXAMPLES = '''
@@ -155,14 +158,14 @@ def core(module):
     except Exception as ex:
         module.fail_json(msg=ex.message)
 
+    predicate = eval(expression) if expression is not None else None
+    collector = FactsCollector(module)
     for htype in hypervisor_types:
         htype.__setattr__('hypervisortype_link', htype._extract_link('self'))
+        if predicate is None or predicate(htype):
+            collector.add(htype.json)
 
-    if expression is not None:
-        htypes = filter(eval(expression), hypervisor_types)
-        module.exit_json(hypervisortypes=map(lambda x: x.json, htypes))
-    else:
-        module.exit_json(hypervisortypes=hypervisor_types)
+    collector.exit_json('hypervisortypes')
 
 
 def main():
@@ -170,6 +173,7 @@ def main():
     arg_spec.update(
         expression=dict(default=None, required=False)
     )
+    arg_spec.update(facts_argument_spec())
     module = AnsibleModule(
         argument_spec=arg_spec
     )
@@ -109,25 +109,23 @@ def core(module):
     api = common.client
 
     try:
-        c, licenses = api.config.licenses.get(
-            headers={'Accept': 'application/vnd.abiquo.licenses+json'})
-        common.check_response(200, c, licenses)
+        lic = next((lic for lic in api.config.licenses.iter_collection(
+            headers={'Accept': 'application/vnd.abiquo.licenses+json'}) if lic.code == code), None)
     except Exception as ex:
         module.fail_json(rc=code, msg=ex.message)
 
-    for lic in licenses:
-        if lic.code == code:
-            if state == 'present':
-                module.exit_json(msg=codeout, changed=False)
-            else:
-                c, licresp = lic.delete()
-                try:
-                    common.check_response(204, c, licresp)
-                except Exception as ex:
-                    module.fail_json(rc=c, msg=ex.message)
-                module.exit_json(
-                    msg='License "%s" deleted' %
-                    codeout, changed=True)
+    if lic is not None:
+        if state == 'present':
+            module.exit_json(msg=codeout, changed=False)
+        else:
+            c, licresp = lic.delete()
+            try:
+                common.check_response(204, c, licresp)
+            except Exception as ex:
+                module.fail_json(rc=c, msg=ex.message)
+            module.exit_json(
+                msg='License "%s" deleted' %
+                codeout, changed=True)
 
     if state == 'absent':
         module.exit_json(msg=codeout, changed=False)
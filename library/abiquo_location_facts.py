@@ -7,8 +7,11 @@
 
 import json
 import traceback
+from abiquo.client import check_response
 from ansible.module_utils.abiquo.common import abiquo_argument_spec
 from ansible.module_utils.abiquo.common import AbiquoCommon
+from ansible.module_utils.abiquo.facts import FactsCollector
+from ansible.module_utils.abiquo.facts import facts_argument_spec
 from ansible.module_utils._text import to_native
 from ansible.module_utils.basic import AnsibleModule
 ANSIBLE_METADATA = {'metadata_version': '0.1',
@@ -79,6 +82,7 @@ options:
         description:
           - The private network to create in the VDC.
         required: False
+extends_documentation_fragment: abiquo_facts
 '''
 
 EXAMPLES = '''
@@ -130,7 +134,6 @@ def core(module):
         module.fail_json(msg=ex.message)
     api = common.client
 
-    locations = []
     params = {}
     if has is not None:
         params['has'] = has
@@ -139,27 +142,21 @@ def core(module):
     if inscope is not None:
         params['inscope'] = inscope
 
-    c, datacenters = api.cloud.locations.get(headers={'Accept': 'application/vnd.abiquo.datacenters+json'},
-                                             params=params)
+    collector = FactsCollector(module, common)
     try:
-        common.check_response(200, c, datacenters)
+        responses = common.get_all([
+            (api.cloud.locations, {'headers': {'Accept': media_type}, 'params': params})
+            for media_type in ['application/vnd.abiquo.datacenters+json',
+                               'application/vnd.abiquo.publiccloudregions+json']
+        ])
+        for code, locations in responses:
+            check_response(200, code, locations)
+            for location in locations:
+                collector.add(location.json)
     except Exception as ex:
-        module.fail_json(rc=c, msg=ex.message)
-
-    for dc in datacenters:
-        locations.append(dc.json)
-
-    c, pcrs = api.cloud.locations.get(headers={'Accept': 'application/vnd.abiquo.publiccloudregions+json'},
-                                      params=params)
-    try:
-        common.check_response(200, c, pcrs)
-    except Exception as ex:
-        module.fail_json(rc=c, msg=ex.message)
-
-    for pcr in pcrs:
-        locations.append(pcr.json)
+        module.fail_json(msg=ex.message)
 
-    module.exit_json(locations=locations)
+    collector.exit_json('locations')
 
 
 def main():
@@ -169,6 +166,7 @@ def main():
         has=dict(default=None, required=False),
         inscope=dict(default=None, required=False),
     )
+    arg_spec.update(facts_argument_spec())
     module = AnsibleModule(
         argument_spec=arg_spec
     )
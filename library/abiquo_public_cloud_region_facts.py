@@ -10,6 +10,8 @@ import traceback
 from ansible.module_utils.abiquo import pcr as pcr_module
 from ansible.module_utils.abiquo.common import abiquo_argument_spec
 from ansible.module_utils.abiquo.common import AbiquoCommon
+from ansible.module_utils.abiquo.facts import FactsCollector
+from ansible.module_utils.abiquo.facts import facts_argument_spec
 from ansible.module_utils._text import to_native
 from ansible.module_utils.basic import AnsibleModule
 ANSIBLE_METADATA = {'metadata_version': '0.1',
@@ -78,6 +80,7 @@ options:
           - Expression to apply to the results for further filtering
         required: False
         default: null
+extends_documentation_fragment: abiquo_facts
 '''
 
 EXAMPLES = '''
@@ -109,14 +112,14 @@ def core(module):
     except Exception as ex:
         module.fail_json(msg=ex.message)
 
+    predicate = eval(expression) if expression is not None else None
+    collector = FactsCollector(module)
     for pcr in public_cloud_regions:
         pcr.__setattr__('pcr_link', pcr._extract_link('edit'))
+        if predicate is None or predicate(pcr):
+            collector.add(pcr.json)
 
-    if expression is not None:
-        pcrs = filter(eval(expression), public_cloud_regions)
-        module.exit_json(pcrs=map(lambda x: x.json, pcrs))
-    else:
-        module.exit_json(pcrs=public_cloud_regions)
+    collector.exit_json('pcrs')
 
 
 def main():
@@ -125,6 +128,7 @@ def main():
         params=dict(default=None, required=False, type='dict'),
         expression=dict(default=None, required=False)
     )
+    arg_spec.update(facts_argument_spec())
     module = AnsibleModule(
         argument_spec=arg_spec
     )
@@ -11,6 +11,7 @@
 
 import json
 import traceback
+from ansible.module_utils.abiquo import template
 from ansible.module_utils.abiquo.common import abiquo_argument_spec
 from ansible.module_utils.abiquo.common import AbiquoCommon
 from ansible.module_utils._text import to_native
@@ -106,38 +107,27 @@ def core(module):
         module.fail_json(msg=ex.message)
     api = common.client
 
-    c, user = api.login.get()
+    # Always read from the API, an outdated cached catalog would skip a
+    # create or a delete. This refreshes the cache for the other modules.
     try:
-        common.check_response(200, c, user)
+        catalog = template.get_remote_repositories(common, refresh=True)
     except Exception as ex:
-        module.fail_json(rc=c, msg=ex.message)
-
-    c, enterprise = user.follow('enterprise').get()
-    try:
-        common.check_response(200, c, enterprise)
-    except Exception as ex:
-        module.fail_json(rc=c, msg=ex.message)
-
-    c, remote_repos = enterprise.follow(
-        'appslib/templateDefinitionLists').get()
-    try:
-        common.check_response(200, c, remote_repos)
-    except Exception as ex:
-        module.fail_json(rc=c, msg=ex.message)
-
-    remote_repo = filter(lambda x: x.url == url, remote_repos)
-    if len(remote_repo) > 0:
-        remote_repo = remote_repo[0]
-    else:
-        remote_repo = None
+        module.fail_json(msg=str(ex))
+    remote_repo = catalog['by_url'].get(url)
 
     if remote_repo is not None:
         if state == 'present':
             module.exit_json(
                 msg='Remote repository with url "%s" already exists' %
-                url, changed=False, repo=remote_repo.json)
+                url, changed=False, repo=remote_repo['repository'])
         else:
-            c, rresp = remote_repo.delete()
+            link = common.getLink(remote_repo['repository'], 'edit')
+            c, rresp = api._request('delete', link['href'])
+            template.invalidate_remote_repositories(common)
+            if c == 404:
+                module.exit_json(
+                    msg='Remote repository with url "%s" does not exist' %
+                    url, changed=False)
             try:
                 common.check_response(204, c, rresp)
             except Exception as ex:
@@ -151,12 +141,14 @@ def core(module):
                 msg='Remote repository with url "%s" does not exist' %
                 url, changed=False)
         else:
-            c, rrepo = enterprise.follow('appslib/templateDefinitionLists').post(
+            c, rrepo = api._request(
+                'post', catalog['link']['href'],
                 headers={
                     'accept': 'application/vnd.abiquo.templatedefinitionlist+json',
                     'content-type': 'text/plain'},
                 data=url
             )
+            template.invalidate_remote_repositories(common)
             try:
                 common.check_response(201, c, rrepo)
             except Exception as ex:
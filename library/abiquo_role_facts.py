@@ -9,6 +9,8 @@ import json
 import traceback
 from ansible.module_utils.abiquo.common import abiquo_argument_spec
 from ansible.module_utils.abiquo.common import AbiquoCommon
+from ansible.module_utils.abiquo.facts import FactsCollector
+from ansible.module_utils.abiquo.facts import facts_argument_spec
 from ansible.module_utils._text import to_native
 from ansible.module_utils.basic import AnsibleModule
 ANSIBLE_METADATA = {'metadata_version': '0.1',
@@ -77,6 +79,7 @@ options:
           - Expression to apply to the results for further filtering
         required: False
         default: null
+extends_documentation_fragment: abiquo_facts
 '''
 
 EXAMPLES = '''
@@ -111,20 +114,18 @@ def core(module):
     if params is not None and not "limit" in params:
         params['limit'] = 0
 
+    predicate = eval(expression) if expression is not None else None
+    collector = FactsCollector(module, common)
     try:
-        c, roles = api.admin.roles.get(
-            headers={'Accept': 'application/vnd.abiquo.roles+json'},
-            params=params
-        )
-        common.check_response(200, c, roles)
+        for role in api.admin.roles.iter_collection(
+                headers={'Accept': 'application/vnd.abiquo.roles+json'},
+                params=params):
+            if predicate is None or predicate(role):
+                collector.add(role.json)
     except Exception as ex:
         module.fail_json(msg=ex.message)
 
-    if expression is not None:
-        r = filter(eval(expression), roles)
-        module.exit_json(roles=map(lambda x: x.json, r))
-    else:
-        module.exit_json(roles=roles.collection)
+    collector.exit_json('roles')
 
 
 def main():
@@ -133,6 +134,7 @@ def main():
         params=dict(default=None, required=False, type='dict'),
         expression=dict(default=None, required=False)
     )
+    arg_spec.update(facts_argument_spec())
     module = AnsibleModule(
         argument_spec=arg_spec
     )
@@ -18,6 +18,7 @@ from ansible.module_utils.abiquo.common import abiquo_argument_spec
 from ansible.module_utils.abiquo.common import AbiquoCommon
 from ansible.module_utils._text import to_native
 from ansible.module_utils.basic import AnsibleModule
+from abiquo.client import check_response
 ANSIBLE_METADATA = {'metadata_version': '0.1',
                     'status': ['preview'],
                     'supported_by': 'community'}
@@ -76,16 +77,32 @@ options:
         default: null
     template_name:
         description:
-          - Name of the template definition to download
-        required: True
+          - Name of the template definition to download. Required unless templates is set.
+        required: False
     remote_repository_url:
         description:
           - URL of the remote repository to download the template from
         required: True
     datacenter:
         description:
-          - Name of the datacenter where the template should be downloaded
-        required: True
+          - Name of the datacenter where the template should be downloaded. Required unless templates is set.
+        required: False
+    templates:
+        description:
+          - Template definitions to download in one go with state download, instead of template_name. Each item is a name, or a dict with the 'name' and optionally the 'datacenter' and 'remote_repository_url'.
+          - The remote repository catalog is read once, the templates already in each datacenter are skipped and the rest of downloads are requested at once. With wait_for_download, their tasks are tracked concurrently.
+          - The result has one entry per template and datacenter in 'templates'.
+        required: False
+    datacenters:
+        description:
+          - Names of the datacenters the items of templates without a 'datacenter' are downloaded to. Defaults to datacenter.
+        required: False
+    refresh_catalog:
+        description:
+          - Whether to read the remote repositories and their template definitions from the API instead of the cache.
+          - The catalog is cached for abiquo_cache_ttl seconds in abiquo_cache_dir, and read again anyway when it does not have the repository or template requested.
+        required: False
+        default: False
     wait_for_download:
         description:
           - If state is download, whether or not to wait for the template to be fully downloaded before moving on.
@@ -122,11 +139,125 @@ EXAMPLES = '''
       attribs:
         guestSetup: CLOUD_INIT
 
+  - name: Download the base templates to both datacenters
+    abiquo_template_download:
+      api_url: http://localhost:8009/api
+      api_user: admin
+      api_pass: xabiquo
+      datacenters: [dc-east, dc-west]
+      remote_repository_url: https://abq-repo-test.s3.amazonaws.com/ovfindex.xml
+      templates:
+        - Alpine Linux
+        - name: Ubuntu 18.04
+          datacenter: dc-east
+      wait_for_download: yes
+      state: download
+
+'''
+
+RETURN = '''
+templates:
+    description:
+      - One entry per template and datacenter when templates is set, with its 'name', 'datacenter' and 'status', one of 'present', 'downloading', 'downloaded' or 'failed' (with the error in 'msg').
+      - Downloaded templates also have the 'template_link', the 'seconds' since the download was requested and, if the definition declares its disk size, the 'bytes' and 'bytes_per_second'.
+    returned: when templates is set
+    type: list
+throughput:
+    description: Total 'bytes' of the downloaded templates, the 'seconds' from the first request to the last download and the resulting 'bytes_per_second'.
+    returned: when templates is set and wait_for_download is true
+    type: dict
 '''
 
 # import module snippets
 
 
+def batch_download(module, common):
+    '''Downloads several template definitions to several datacenters, returning one result per pair.'''
+    default_dcs = module.params['datacenters'] or [module.params['datacenter']]
+    jobs = []
+    for item in module.params['templates']:
+        item = item if isinstance(item, dict) else {'name': item}
+        for dc_name in ([item['datacenter']] if item.get('datacenter') else default_dcs):
+            jobs.append({'name': item['name'], 'datacenter': dc_name,
+                         'url': item.get('remote_repository_url') or module.params['remote_repository_url']})
+
+    common.login()
+    code, enterprise = common.user.follow('enterprise').get()
+    check_response(200, code, enterprise)
+
+    code, repos = enterprise.follow('datacenterrepositories').get()
+    check_response(200, code, repos)
+    repos = dict((r._extract_link('datacenter')['title'], r) for r in repos if r._has_link('datacenter'))
+
+    dc_names = sorted(set(j['datacenter'] for j in jobs if j['datacenter'] in repos))
+    existing = {}
+    for dc_name, (ok, value) in zip(dc_names, common.bulk_map(
+            lambda dc_name: list(repos[dc_name].follow('virtualmachinetemplates').iter_collection()), dc_names)):
+        if not ok:
+            raise value
+        existing[dc_name] = dict((t.name, t) for t in reversed(value))
+
+    submit = []
+    for job in jobs:
+        if job['datacenter'] not in repos:
+            job.update(status='failed', msg='Datacenter repo for datacenter %s not found' % job['datacenter'])
+            continue
+        if job['name'] in existing[job['datacenter']]:
+            job.update(status='present',
+                       template_link=existing[job['datacenter']][job['name']]._extract_link('edit'))
+            continue
+        try:
+            job['definition'] = template.find_template_definition(common, job['url'], job['name'],
+                                                                  module.params['refresh_catalog'])
+        except Exception as ex:
+            job.update(status='failed', msg=str(ex))
+            continue
+        if job['definition'] is None:
+            job.update(status='failed', msg='Template definition with name %s not found in remote repository %s' %
+                       (job['name'], job['url']))
+        else:
+            submit.append(job)
+
+    started = time.time()
+    for job, (ok, value) in zip(submit, common.bulk_map(
+            lambda job: template.request_download(repos[job['datacenter']], job['definition']), submit)):
+        job['submitted_at'] = time.time()
+        if ok:
+            job.update(status='downloading', task=value)
+        else:
+            job.update(status='failed', msg=str(value))
+
+    throughput = None
+    if module.params['wait_for_download']:
+        tracked = [job for job in submit if job['status'] == 'downloading']
+        delay = module.params['abiquo_retry_delay']
+        results = template.track_tasks(common, [job['task'] for job in tracked],
+                                       module.params['abiquo_max_attempts'] * delay, max_delay=delay)
+        for job, (task, finished_at, error) in zip(tracked, results):
+            if finished_at is None:
+                job.update(status='failed', msg=error or 'Download not finished in time, task state %s' %
+                           getattr(task, 'state', 'unknown'))
+            elif task.state != 'FINISHED_SUCCESSFULLY':
+                job.update(status='failed', msg='Download task failed, check events.')
+            else:
+                tpl = template.lookup_result(task)
+                job.update(status='downloaded', template_link=tpl._extract_link('edit'),
+                           seconds=round(finished_at - job['submitted_at'], 3))
+                size = job['definition'].get('diskFileSize')
+                if size:
+                    job.update(bytes=size, bytes_per_second=int(size / max(job['seconds'], 0.001)))
+
+        downloaded = [job for job in tracked if job['status'] == 'downloaded']
+        if downloaded:
+            elapsed = max(job['submitted_at'] + job['seconds'] for job in downloaded) - started
+            total = sum(job.get('bytes', 0) for job in downloaded)
+            throughput = {'bytes': total, 'seconds': round(elapsed, 3),
+                          'bytes_per_second': int(total / max(elapsed, 0.001))}
+
+    keys = ('name', 'datacenter', 'status', 'msg', 'template_link', 'seconds', 'bytes', 'bytes_per_second')
+    return [dict((k, job[k]) for k in keys if k in job) for job in jobs], throughput
+
+
 def core(module):
     template_name = module.params['template_name']
     remote_repository_url = module.params['remote_repository_url']
@@ -139,6 +270,21 @@ def core(module):
         module.fail_json(msg=ex.message)
     api = common.client
 
+    if module.params['templates']:
+        if state != 'download':
+            module.fail_json(msg='templates is only supported with state download')
+        try:
+            results, throughput = batch_download(module, common)
+        except Exception as ex:
+            module.fail_json(msg=str(ex))
+        failed = [r for r in results if r['status'] == 'failed']
+        changed = any(r['status'] in ('downloading', 'downloaded') for r in results)
+        if failed:
+            module.fail_json(msg='%d of %d template downloads failed' % (len(failed), len(results)),
+                             templates=results, throughput=throughput, changed=changed)
+        module.exit_json(msg='%d templates requested' % len([r for r in results if r['status'] != 'present']),
+                         templates=results, throughput=throughput, changed=changed)
+
     datacenters = datacenter.list(module)
     dc = filter(lambda x: x.name == dc_name, datacenters)
     if len(dc) == 0:
@@ -222,9 +368,12 @@ def core(module):
 def main():
     arg_spec = abiquo_argument_spec()
     arg_spec.update(
-        template_name=dict(default=None, required=True),
+        template_name=dict(default=None, required=False),
         remote_repository_url=dict(default=None, required=True),
-        datacenter=dict(default=None, required=True),
+        datacenter=dict(default=None, required=False),
+        templates=dict(default=None, required=False, type='list'),
+        datacenters=dict(default=None, required=False, type='list'),
+        refresh_catalog=dict(default=False, required=False, type='bool'),
         attribs=dict(default=None, required=False, type=dict),
         wait_for_download=dict(default=False, required=False, type='bool'),
         state=dict(
@@ -235,7 +384,9 @@ def main():
                 'download']),
     )
     module = AnsibleModule(
-        argument_spec=arg_spec
+        argument_spec=arg_spec,
+        required_one_of=[['template_name', 'templates'], ['datacenter', 'templates']],
+        mutually_exclusive=[['template_name', 'templates']]
     )
 
     try:
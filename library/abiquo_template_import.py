@@ -125,7 +125,7 @@ def lookup_dc_enterprise(module):
     return datacenter, enterprise
 
 
-def delete_template(module):
+def find_template(module):
     datacenter, enterprise = lookup_dc_enterprise(module)
 
     if datacenter is None or enterprise is None:
@@ -133,11 +133,19 @@ def delete_template(module):
 
     template_id = module.params.get('template_id')
     try:
+        common = AbiquoCommon(module)
         dc_repo = enterprise_module.get_repo_for_dc(enterprise, datacenter)
-        template = template_module.find_by_disk_path(dc_repo, template_id)
+        template = template_module.find_by_disk_path(common, dc_repo, template_id)
     except Exception as e:
         module.fail_json(msg=e.message)
 
+    return common, dc_repo, template
+
+
+def delete_template(module):
+    template_id = module.params.get('template_id')
+    common, dc_repo, template = find_template(module)
+
     if template is None:
         module.fail_json(
             msg="Template ID %s already deleted" %
@@ -145,6 +153,7 @@ def delete_template(module):
     else:
         try:
             template_module.delete(template)
+            template_module.forget_disk_path(common, dc_repo, template_id)
             module.exit_json(
                 msg="Template ID %s deleted." %
                 template_id, changed=True)
@@ -153,17 +162,8 @@ def delete_template(module):
 
 
 def update_template(module):
-    datacenter, enterprise = lookup_dc_enterprise(module)
-
-    if datacenter is None or enterprise is None:
-        module.fail_json(msg="Datacenter or enterprise was not found.")
-
     template_id = module.params.get('template_id')
-    try:
-        dc_repo = enterprise_module.get_repo_for_dc(enterprise, datacenter)
-        template = template_module.find_by_disk_path(dc_repo, template_id)
-    except Exception as e:
-        module.fail_json(msg=e.message)
+    common, dc_repo, template = find_template(module)
 
     if template is None:
         module.exit_json(
@@ -184,17 +184,8 @@ def update_template(module):
 
 
 def import_template(module):
-    datacenter, enterprise = lookup_dc_enterprise(module)
-
-    if datacenter is None or enterprise is None:
-        module.fail_json(msg="Datcenter or enterprise was not found.")
-
     template_id = module.params.get('template_id')
-    try:
-        dc_repo = enterprise_module.get_repo_for_dc(enterprise, datacenter)
-        template = template_module.find_by_disk_path(dc_repo, template_id)
-    except Exception as e:
-        module.fail_json(msg=e.message)
+    common, dc_repo, template = find_template(module)
 
     if template is None:
         try:
@@ -210,6 +201,7 @@ def import_template(module):
         try:
             imported_template = template_module.import_template(
                 dc_repo, template)
+            template_module.remember_disk_path(common, dc_repo, template_id, imported_template)
         except Exception as e:
             module.fail_json(msg=e.message)
 
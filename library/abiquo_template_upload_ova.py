@@ -5,10 +5,14 @@
 # GNU General Public License v3.0+ (see COPYING or
 # https://www.gnu.org/licenses/gpl-3.0.txt)
 
+import os
 import traceback
 import time
 import json
 from ansible.module_utils.abiquo import template as template_module
+from ansible.module_utils.abiquo import ova as ova_module
+from ansible.module_utils.abiquo.bulk import AimdLimiter
+from ansible.module_utils.abiquo.bulk import bulk_map
 from ansible.module_utils.abiquo.common import abiquo_argument_spec
 from ansible.module_utils.abiquo.common import AbiquoCommon
 from ansible.module_utils._text import to_native
@@ -89,6 +93,87 @@ options:
         required: True
         choices: ["present"]
         default: "present"
+    template_files:
+        description:
+          - OVAs to upload in one go, instead of template_file_path. Each item is a path, or a dict with the 'path' and optionally the 'name' and 'guest_setup_type' of the template.
+          - The files are streamed from disk, so memory use does not grow with their size or number. The result has one entry per file in 'templates'.
+        required: False
+    max_parallel_uploads:
+        description:
+          - Files of template_files uploaded at the same time.
+        required: False
+        default: 4
+    bandwidth_limit:
+        description:
+          - Upper bound in bytes per second for the bandwidth used by all the uploads together. Not limited if not set.
+        required: False
+    distribute_to:
+        description:
+          - IDs of other datacenters the OVA (or each of template_files) is uploaded to as well, concurrently with the one of datacenter_id.
+          - The file is streamed from the controller to the Appliance Manager of each datacenter, as the API has no way to copy a template between datacenter repositories. The result has one entry per file and datacenter in 'templates'.
+        required: False
+    progress_file:
+        description:
+          - Path of a JSON file updated every second with the bytes sent by the uploads of template_files or distribute_to, overall and per transfer, to follow them while the module runs.
+        required: False
+    ready_timeout:
+        description:
+          - Seconds to wait for the uploaded template to be registered in the repository and its state to be DONE.
+          - The repository is checked after 1 second, and then with a delay doubling up to 15 seconds.
+        required: False
+        default: 600
+    upload_mode:
+        description:
+          - With 'multipart', the OVA is sent to the Appliance Manager in a single multipart request.
+          - With 'segmented', it is sent in segments of segment_size bytes to segment_target_url or segment_target_dir, recording the sent segments in upload_journal. Failed segments are retried with backoff, and a new run with the same file and target only sends the missing segments.
+          - No Abiquo component implements a segmented upload API, neither the Appliance Manager nor the API, so segment_target_url must point to a custom receiver (see segment_target_url). Without one, only segment_target_dir can be used.
+        required: False
+        choices: ["multipart", "segmented"]
+        default: "multipart"
+    segment_size:
+        description:
+          - Size in bytes of each segment.
+        required: False
+        default: 67108864
+    segment_retries:
+        description:
+          - Times a failed segment is retried before giving up.
+        required: False
+        default: 5
+    segment_target_url:
+        description:
+          - URL of a custom receiver the segments are PUT to, each one with a Content-Range header giving its first and last byte and the file size. The Appliance Manager does not understand these requests.
+          - The receiver must answer each segment with 200, 201, 202, 204 or 308, reassemble the file, register it in the Appliance Manager and answer the last segment with the Location of the template, as the Appliance Manager does for a multipart upload.
+          - '{am_uri} and {enterprise_id} are replaced with the Appliance Manager URI and the enterprise.'
+        required: False
+    segment_target_dir:
+        description:
+          - Directory where the OVA is written segment by segment instead, e.g. a share, or to try out resumable uploads offline. The template is not registered in Abiquo then, and the result has the 'path' of the file.
+        required: False
+    upload_journal:
+        description:
+          - Path of the journal of sent segments. Defaults to the OVA path with a '.upload.json' suffix.
+        required: False
+    validate:
+        description:
+          - Checks done on the OVA before uploading it, so a malformed image fails right away instead of after the transfer.
+          - With 'structure', the OVF descriptor is parsed and it is checked that the files it references are in the archive with the declared sizes. Only the tar headers are read.
+          - With 'manifest', the digests of the .mf manifest are verified too, reading the whole OVA once.
+        required: False
+        choices: ["none", "structure", "manifest"]
+        default: "structure"
+    dedup:
+        description:
+          - Whether to skip uploading an OVA whose content was already uploaded to the same enterprise and datacenter, returning the existing template instead.
+          - Templates are looked up by the SHA-256 of the file in upload_index, and only reused if they still exist in the API. The template_name and guest_setup_type given are applied to the reused template.
+          - The first time a file is seen it is read once more to compute its SHA-256 before being uploaded.
+        required: False
+        default: False
+    upload_index:
+        description:
+          - Path of the file mapping the SHA-256 of the uploaded OVAs to their templates. It also keeps the hash of each file by path, size and modification time, so unchanged files are not hashed again.
+        required: False
+        default: "~/.ansible/abiquo/ova_uploads.json"
 '''
 
 EXAMPLES = '''
@@ -100,6 +185,75 @@ EXAMPLES = '''
       datacenter_id: 4
       template_file_path: /home/xrins/file.ova
       state: present
+
+  - name: Upload the release templates, 3 at a time and at most 50 MB/s in total
+    abiquo_template_upload_ova:
+      api_url: http://localhost:8009/api
+      api_user: admin
+      api_pass: xabiquo
+      enterprise_id: 1
+      datacenter_id: 4
+      template_files:
+        - /srv/images/centos.ova
+        - path: /srv/images/ubuntu.ova
+          name: Ubuntu 18.04
+      max_parallel_uploads: 3
+      bandwidth_limit: 52428800
+
+  - name: Upload a template to three datacenters at once
+    abiquo_template_upload_ova:
+      api_url: http://localhost:8009/api
+      api_user: admin
+      api_pass: xabiquo
+      enterprise_id: 1
+      datacenter_id: 4
+      distribute_to: [5, 6]
+      template_file_path: /srv/images/centos.ova
+      template_name: CentOS 7
+      progress_file: /tmp/centos-upload.json
+'''
+
+RETURN = '''
+template_id:
+    description: The ID of the uploaded template.
+    returned: success
+    type: int
+size:
+    description: Size in bytes of the uploaded OVA.
+    returned: success
+    type: int
+sha256:
+    description: SHA-256 of the uploaded OVA, computed while it was sent.
+    returned: success
+    type: string
+validation:
+    description: Result of the validation, with the OVF 'descriptor', the 'manifest', the referenced 'files' and the files whose digests were 'verified'.
+    returned: when validate is not none and the OVA was uploaded
+    type: dict
+deduplicated:
+    description: Whether the template already existed and the upload was skipped. Also set on each entry of 'templates'.
+    returned: success
+    type: bool
+updated:
+    description: Whether the name or guest setup of a reused template were changed to the ones given. Also set on each entry of 'templates'.
+    returned: when deduplicated
+    type: bool
+upload:
+    description: Details of the upload. In segmented mode, the number of 'segments', 'resumed_segments' already sent by a previous run and 'retried_segments'.
+    returned: success
+    type: dict
+templates:
+    description: One entry per file of template_files and datacenter, with its 'path', 'datacenter_id', 'template_id', 'size', 'sha256', 'upload_seconds' and 'deduplicated', or 'failed' and the error 'msg'.
+    returned: when template_files or distribute_to are set
+    type: list
+progress:
+    description: Combined progress of the transfers, with the 'total_bytes' and 'sent_bytes', the 'elapsed_seconds', the overall 'bytes_per_second' and the 'transfers' keyed by path and datacenter.
+    returned: when template_files or distribute_to are set
+    type: dict
+path:
+    description: Path of the staged file.
+    returned: when segment_target_dir is set
+    type: string
 '''
 
 
@@ -117,19 +271,79 @@ def core(module):
     except ValueError as ex:
         module.fail_json(msg=ex.message)
     api = common.client
+    index = ova_module.UploadIndex(module.params['upload_index']) if module.params['dedup'] else None
+
+    if module.params['template_files'] or module.params['distribute_to']:
+        if module.params['upload_mode'] != 'multipart':
+            module.fail_json(msg='template_files and distribute_to are only supported in multipart mode')
+        try:
+            results, progress = upload_batch(module, api, index)
+        except Exception as ex:
+            module.fail_json(msg=to_native(ex))
+        failed = [r for r in results if r['failed']]
+        uploaded = [r for r in results if not r['failed'] and not r['deduplicated']]
+        changed = len(uploaded) > 0 or any(r.get('updated') for r in results)
+        if failed:
+            module.fail_json(msg='{} of {} OVA uploads failed'.format(len(failed), len(results)),
+                             templates=results, progress=progress, changed=changed)
+        module.exit_json(msg='{} templates uploaded'.format(len(uploaded)), templates=results,
+                         progress=progress, changed=changed)
 
     try:
-        am_uri = get_am_uri(api, datacenter_id)
-        location = upload_ova(am_uri, api_user, api_pass, enterprise_id, template_file_path)
-        time.sleep(30)
-        template_object = edit_uploaded_ova(api, enterprise_id, datacenter_id, location, guest_setup_type, template_name)
+        staging = module.params['upload_mode'] == 'segmented' and module.params['segment_target_dir'] is not None
+        # Before the dedup lookup, which reads the whole file to hash it
+        validation = validate_ova(module, template_file_path)
+        if index is not None and not staging:
+            template_object, sha256 = find_uploaded(api, index, enterprise_id, datacenter_id, template_file_path)
+            if template_object is not None:
+                template_object, updated = update_template(template_object, template_name, guest_setup_type)
+                module.exit_json(
+                    msg='Template with ID {} already uploaded'.format(template_object.id),
+                    template_id=template_object.id,
+                    size=os.path.getsize(template_file_path),
+                    sha256=sha256,
+                    deduplicated=True,
+                    updated=updated,
+                    changed=updated,
+                )
+        am_uri = None
+        if not staging:
+            am_uri = get_am_uri(api, datacenter_id)
+        if module.params['upload_mode'] == 'segmented':
+            upload = upload_ova_segmented(module, api, am_uri)
+            if staging:
+                module.exit_json(
+                    msg='Template file staged in {}'.format(upload['result']),
+                    path=upload['result'],
+                    upload=upload,
+                    validation=validation,
+                    size=upload['size'],
+                    sha256=upload['sha256'],
+                    changed=True,
+                )
+            location = upload['result']
+            if location is None:
+                raise Exception("The segment target did not return the location of the template")
+        else:
+            location, body = upload_ova(am_uri, api_user, api_pass, enterprise_id, template_file_path,
+                                        api.transport.timeout('upload'))
+            upload = {'size': body.size, 'sha256': body.checksum()}
+        template_object = edit_uploaded_ova(api, enterprise_id, datacenter_id, location, guest_setup_type,
+                                            template_name, module.params['ready_timeout'])
+        if index is not None:
+            index.record(enterprise_id, datacenter_id, upload['sha256'], template_file_path, template_object)
         module.exit_json(
             msg='Template with ID {} uploaded'.format(template_object.id),
             template_id=template_object.id,
+            upload=upload,
+            validation=validation,
+            size=upload['size'],
+            sha256=upload['sha256'],
+            deduplicated=False,
             changed=True,
         )
     except Exception as ex:
-        module.fail_json(msg=ex)
+        module.fail_json(msg=to_native(ex))
 
 
 def get_am_uri(api, datacenter_id):
@@ -141,29 +355,165 @@ def get_am_uri(api, datacenter_id):
     raise Exception("Appliance manager not found")
 
 
-def upload_ova(am_url, api_user, api_pass, enterprise_id, template_file_path):
-    template_response = template_module.upload(am_url, api_user, api_pass, enterprise_id, template_file_path)
+def upload_ova(am_url, api_user, api_pass, enterprise_id, template_file_path, timeout=None, throttle=None,
+               progress=None):
+    template_response, body = template_module.upload(am_url, api_user, api_pass, enterprise_id,
+                                                     template_file_path, timeout, throttle, progress)
     if template_response.status_code == 201:
-        return template_response.headers['Location']
+        return template_response.headers['Location'], body
     raise Exception("AM response: {}".format(template_response.status_code))
 
 
-def get_first_element(template_object):
-    for template in template_object:
-        return template
-    raise Exception("Template object has no elements in collection" )
+def validate_ova(module, path):
+    if module.params['validate'] == 'none':
+        return None
+    return ova_module.validate_ova(path, verify_manifest=module.params['validate'] == 'manifest')
+
+
+def find_uploaded(api, index, enterprise_id, datacenter_id, path, sha256=None):
+    '''Returns the template uploaded before from the same content, or None, and the SHA-256 of the file.'''
+    if sha256 is None:
+        sha256 = index.file_sha256(path)
+    entry = index.lookup(enterprise_id, datacenter_id, sha256)
+    if entry is None:
+        return None, sha256
+
+    link = entry['template_link']
+    code, template = api._request('get', link['href'], headers={'accept': link['type']})
+    if code == 404:
+        index.forget(enterprise_id, datacenter_id, sha256)
+        return None, sha256
+    check_response(200, code, template)
+    return template, sha256
+
+
+def update_template(template_object, template_name, guest_setup_type):
+    '''Applies the name and guest setup asked for to a reused template, returning it and whether it changed.'''
+    changed = False
+    if template_name is not None and template_object.json.get('name') != template_name:
+        template_object.name = template_name
+        changed = True
+    if guest_setup_type is not None and template_object.json.get('guestSetup') != guest_setup_type:
+        template_object.guestSetup = guest_setup_type
+        changed = True
+    if not changed:
+        return template_object, False
+    c, response = template_object.put()
+    if c == 200:
+        return response, True
+    raise Exception("API response when editing: {}".format(c))
+
+
+def upload_batch(module, api, index=None):
+    '''Uploads every file to every datacenter, a few at a time, and returns one result per transfer.'''
+    enterprise_id = module.params['enterprise_id']
+    timeout = api.transport.timeout('upload')
+    throttle = None
+    if module.params['bandwidth_limit']:
+        throttle = ova_module.TokenBucket(module.params['bandwidth_limit'])
+    progress = ova_module.TransferProgress(module.params['progress_file'])
+
+    if module.params['template_files']:
+        items = [f if isinstance(f, dict) else {'path': f} for f in module.params['template_files']]
+    else:
+        items = [{'path': module.params['template_file_path'], 'name': module.params['template_name']}]
+    datacenters = [module.params['datacenter_id']]
+    for datacenter_id in module.params['distribute_to'] or []:
+        if str(datacenter_id) not in datacenters:
+            datacenters.append(str(datacenter_id))
+
+    am_uris = dict((datacenter_id, get_am_uri(api, datacenter_id)) for datacenter_id in datacenters)
+    # A fixed pool, the Appliance Manager latency says nothing about the bandwidth
+    parallel = max(1, module.params['max_parallel_uploads'])
+    limiter = AimdLimiter(initial=parallel, minimum=parallel, maximum=parallel)
+
+    def check_file(path):
+        validation = validate_ova(module, path)
+        # Hashed here for the dedup lookup, not once per datacenter
+        sha256 = index.file_sha256(path) if index is not None else None
+        return validation, sha256
+
+    # Each file is read once, before anything is sent
+    paths = []
+    for item in items:
+        if item['path'] not in paths:
+            paths.append(item['path'])
+    checks = {}
+    for path, (ok, value) in zip(paths, bulk_map(check_file, paths, limiter)):
+        if not ok and not isinstance(value, (ova_module.OvaError, IOError, OSError)):
+            raise value
+        checks[path] = value if ok else (value, None)
+
+    def upload_one(job):
+        item, datacenter_id = job
+        validation, sha256 = checks[item['path']]
+        if isinstance(validation, Exception):
+            raise validation
+        if index is not None:
+            template_object, sha256 = find_uploaded(api, index, enterprise_id, datacenter_id, item['path'], sha256)
+            if template_object is not None:
+                template_object, updated = update_template(
+                    template_object, item.get('name'),
+                    item.get('guest_setup_type', module.params['guest_setup_type']))
+                return {'template_id': template_object.id, 'size': os.path.getsize(item['path']),
+                        'sha256': sha256, 'upload_seconds': 0, 'deduplicated': True, 'updated': updated}
 
+        key = '{}@{}'.format(item['path'], datacenter_id)
+        progress.start(key, os.path.getsize(item['path']))
+        start = time.time()
+        try:
+            location, body = upload_ova(am_uris[datacenter_id], module.params['abiquo_api_user'],
+                                        module.params['abiquo_api_pass'], enterprise_id, item['path'], timeout,
+                                        throttle, lambda amount: progress.advance(key, amount))
+        except Exception:
+            progress.finish(key, 'FAILED')
+            raise
+        elapsed = time.time() - start
+        progress.finish(key, 'DONE')
+        template_object = edit_uploaded_ova(api, enterprise_id, datacenter_id, location,
+                                            item.get('guest_setup_type', module.params['guest_setup_type']),
+                                            item.get('name'), module.params['ready_timeout'])
+        if index is not None:
+            index.record(enterprise_id, datacenter_id, body.checksum(), item['path'], template_object)
+        return {'template_id': template_object.id, 'size': body.size, 'sha256': body.checksum(),
+                'upload_seconds': round(elapsed, 3), 'deduplicated': False, 'validation': validation}
 
-def edit_uploaded_ova(api, enterprise_id, datacenter_id, location, guest_setup_type, template_name):
+    jobs = [(item, datacenter_id) for item in items for datacenter_id in datacenters]
+    results = []
+    for (item, datacenter_id), (ok, value) in zip(jobs, bulk_map(upload_one, jobs, limiter)):
+        if ok:
+            results.append(dict(value, path=item['path'], datacenter_id=datacenter_id, failed=False))
+        else:
+            results.append({'path': item['path'], 'datacenter_id': datacenter_id, 'failed': True,
+                            'msg': str(value)})
+    return results, progress.summary()
+
+
+def upload_ova_segmented(module, api, am_uri):
+    template_file_path = module.params['template_file_path']
+    if module.params['segment_target_dir'] is not None:
+        target = ova_module.DirectoryTarget(module.params['segment_target_dir'],
+                                            os.path.basename(template_file_path))
+    elif module.params['segment_target_url'] is not None:
+        target = ova_module.HttpRangeTarget(
+            module.params['segment_target_url'].format(am_uri=am_uri, enterprise_id=module.params['enterprise_id']),
+            (module.params['abiquo_api_user'], module.params['abiquo_api_pass']),
+            timeout=api.transport.timeout('upload'))
+    else:
+        raise Exception("segment_target_url or segment_target_dir are required to upload in segments")
+
+    journal = module.params['upload_journal'] or template_file_path + '.upload.json'
+    return ova_module.upload_segmented(template_file_path, target, journal, module.params['segment_size'],
+                                       retries=module.params['segment_retries'])
+
+
+def edit_uploaded_ova(api, enterprise_id, datacenter_id, location, guest_setup_type, template_name,
+                      ready_timeout=600):
     template_disk_path = location.split('/templates/')[1]
     if template_disk_path[-1] == "/":
         template_disk_path = template_disk_path.rstrip(template_disk_path[-1])
-    templates_object = template_module.find_template_by_path(api, enterprise_id, template_disk_path, datacenter_id)
-    try:
-        template_object = get_first_element(templates_object)
-    except Exception as e:
-        #raise Exception(str(e) + ". Current template path is " + template_disk_path + templates_object.json)
-        raise Exception(templates_object.json)
+    template_object = template_module.wait_for_template_by_path(api, enterprise_id, template_disk_path,
+                                                                datacenter_id, ready_timeout)
 
     if template_name is not None:
         template_object.name = template_name
@@ -182,7 +532,12 @@ def main():
         template_name=dict(default=None, required=False),
         enterprise_id=dict(default=None, required=True),
         datacenter_id=dict(default=None, required=True),
-        template_file_path=dict(default=None, required=True),
+        template_file_path=dict(default=None, required=False),
+        template_files=dict(default=None, required=False, type='list'),
+        max_parallel_uploads=dict(default=4, required=False, type='int'),
+        bandwidth_limit=dict(default=None, required=False, type='int'),
+        distribute_to=dict(default=None, required=False, type='list'),
+        progress_file=dict(default=None, required=False, type='path'),
         guest_setup_type=dict(
             default=None,
             choices=[
@@ -196,9 +551,21 @@ def main():
                 'present'
             ]
         ),
+        ready_timeout=dict(default=600, required=False, type='int'),
+        upload_mode=dict(default='multipart', choices=['multipart', 'segmented']),
+        segment_size=dict(default=64 * 1024 * 1024, required=False, type='int'),
+        segment_retries=dict(default=5, required=False, type='int'),
+        segment_target_url=dict(default=None, required=False),
+        segment_target_dir=dict(default=None, required=False, type='path'),
+        upload_journal=dict(default=None, required=False, type='path'),
+        validate=dict(default='structure', choices=['none', 'structure', 'manifest']),
+        dedup=dict(default=False, required=False, type='bool'),
+        upload_index=dict(default='~/.ansible/abiquo/ova_uploads.json', required=False, type='path'),
     )
     module = AnsibleModule(
-        argument_spec=arg_spec
+        argument_spec=arg_spec,
+        required_one_of=[['template_file_path', 'template_files']],
+        mutually_exclusive=[['template_file_path', 'template_files']]
     )
 
     try:
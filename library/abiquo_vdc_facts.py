@@ -9,6 +9,8 @@ import traceback
 from abiquo.client import check_response
 from ansible.module_utils.abiquo.common import abiquo_argument_spec
 from ansible.module_utils.abiquo.common import AbiquoCommon
+from ansible.module_utils.abiquo.facts import FactsCollector
+from ansible.module_utils.abiquo.facts import facts_argument_spec
 from ansible.module_utils._text import to_native
 from ansible.module_utils.basic import AnsibleModule
 ANSIBLE_METADATA = {'metadata_version': '0.1',
@@ -83,6 +85,7 @@ options:
         description:
           - If present, it will return the vdc for the vdc with this id
         required: False
+extends_documentation_fragment: abiquo_facts
 '''
 
 EXAMPLES = '''
@@ -142,7 +145,7 @@ def core(module):
         module.fail_json(msg=ex.message)
     api = common.client
 
-    all_vdcs = []
+    collector = FactsCollector(module, common)
 
     try:
         if vdc_id is not None:
@@ -151,7 +154,7 @@ def core(module):
             check_response(200, c, vdc)
             j = vdc.json
             j['vdc_link'] = vdc._extract_link('edit')
-            all_vdcs.append(j)
+            collector.add(j)
         else:
             params = {}
             if has is not None:
@@ -161,21 +164,16 @@ def core(module):
             if datacenter is not None:
                 params['datacenter'] = datacenter
 
-            c, vdcs = api.cloud.virtualdatacenters.get(
-                headers={'Accept': 'application/vnd.abiquo.virtualdatacenters+json'},
-                params=params
-            )
-
-            check_response(200, c, vdcs)
-
-            for vdc in vdcs:
+            for vdc in api.cloud.virtualdatacenters.iter_collection(
+                    headers={'Accept': 'application/vnd.abiquo.virtualdatacenters+json'},
+                    params=params):
                 j = vdc.json
                 j['vdc_link'] = vdc._extract_link('edit')
-                all_vdcs.append(j)
+                collector.add(j)
     except Exception as ex:
-        module.fail_json(rc=c, msg=ex.message)
+        module.fail_json(msg=ex.message)
 
-    module.exit_json(vdcs=all_vdcs)
+    collector.exit_json('vdcs')
 
 
 def main():
@@ -186,6 +184,7 @@ def main():
         has=dict(default=None, required=False),
         id=dict(default=None, required=False)
     )
+    arg_spec.update(facts_argument_spec())
     module = AnsibleModule(
         argument_spec=arg_spec
     )
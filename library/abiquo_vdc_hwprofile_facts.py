@@ -9,6 +9,8 @@ import json
 import traceback
 from ansible.module_utils.abiquo.common import abiquo_argument_spec
 from ansible.module_utils.abiquo.common import AbiquoCommon
+from ansible.module_utils.abiquo.facts import FactsCollector
+from ansible.module_utils.abiquo.facts import facts_argument_spec
 from ansible.module_utils._text import to_native
 from ansible.module_utils.basic import AnsibleModule
 ANSIBLE_METADATA = {'metadata_version': '0.1',
@@ -75,6 +77,7 @@ options:
         description:
           - A collection of params to filter the search
         required: False
+extends_documentation_fragment: abiquo_facts
 '''
 
 EXAMPLES = '''
@@ -125,21 +128,18 @@ def core(module):
     except Exception as ex:
         module.fail_json(rc=c, msg=ex.message)
 
-    code, hwprofiles = location.follow('hardwareprofiles').get()
+    collector = FactsCollector(module, common)
     try:
-        common.check_response(200, code, hwprofiles)
+        for profile in location.follow('hardwareprofiles').iter_collection():
+            j = profile.json
+            link = profile._extract_link('self') if profile._extract_link(
+                'self') is not None else profile._extract_link('edit')
+            j['hwprofile_link'] = link
+            collector.add(j)
     except Exception as ex:
-        module.fail_json(rc=c, msg=ex.message)
-
-    all_profiles = []
-    for profile in hwprofiles:
-        j = profile.json
-        link = profile._extract_link('self') if profile._extract_link(
-            'self') is not None else profile._extract_link('edit')
-        j['hwprofile_link'] = link
-        all_profiles.append(j)
+        module.fail_json(msg=ex.message)
 
-    module.exit_json(hwprofiles=all_profiles)
+    collector.exit_json('hwprofiles')
 
 
 def main():
@@ -148,6 +148,7 @@ def main():
         vdc=dict(default=None, required=True, type='dict'),
         params=dict(default={}, required=False, type='dict'),
     )
+    arg_spec.update(facts_argument_spec())
     module = AnsibleModule(
         argument_spec=arg_spec
     )
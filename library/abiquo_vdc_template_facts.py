@@ -9,6 +9,9 @@ import json
 import traceback
 from ansible.module_utils.abiquo.common import abiquo_argument_spec
 from ansible.module_utils.abiquo.common import AbiquoCommon
+from ansible.module_utils.abiquo.facts import FactsCollector
+from ansible.module_utils.abiquo.facts import facts_argument_spec
+from ansible.module_utils.abiquo import template as template_module
 from ansible.module_utils._text import to_native
 from ansible.module_utils.basic import AnsibleModule
 ANSIBLE_METADATA = {'metadata_version': '0.1',
@@ -73,8 +76,19 @@ options:
         required: True
     params:
         description:
-          - A collection of params to filter the search
+          - A collection of params to filter the search. Cannot be combined with name or id.
         required: False
+    name:
+        description:
+          - If present, only the template with this exact name is returned, and its link as 'template_link'.
+          - The first one is returned if several templates share the name.
+          - Templates are looked up in the catalog of the VDC, which is cached for abiquo_cache_ttl seconds when abiquo_cache_dir is set, and revalidated with a conditional request afterwards.
+        required: False
+    id:
+        description:
+          - If present, only the template with this ID is returned, and its link as 'template_link'.
+        required: False
+extends_documentation_fragment: abiquo_facts
 '''
 
 EXAMPLES = '''
@@ -94,6 +108,27 @@ EXAMPLES = '''
     vdc: "{{ vdc }}"
     params:
         has: test
+
+- name: Gather only the name and the edit link of the templates in VDC 'someVDC'
+  abiquo_vdc_template_facts:
+    api_url: http://localhost:8009/api
+    api_user: admin
+    api_pass: xabiquo
+    vdc: "{{ vdc }}"
+    fields:
+      - name
+      - template_link
+
+- name: Find the link of template 'ubuntu' in VDC 'someVDC', caching the catalog for 10 minutes
+  abiquo_vdc_template_facts:
+    api_url: http://localhost:8009/api
+    api_user: admin
+    api_pass: xabiquo
+    abiquo_cache_dir: ~/.cache/abiquo
+    abiquo_cache_ttl: 600
+    vdc: "{{ vdc }}"
+    name: ubuntu
+  register: tpl
 '''
 
 RETURN = '''
@@ -102,12 +137,18 @@ templates:
     returned: success
     type: complex
     contains: Check Abiquo API documentation
+template_link:
+    description: The link to the template found by name or id.
+    returned: when name or id are set
+    type: dict
 '''
 
 
 def core(module):
     vdc_json = module.params['vdc']
     params = module.params['params']
+    name = module.params['name']
+    template_id = module.params['id']
 
     try:
         common = AbiquoCommon(module)
@@ -115,23 +156,35 @@ def core(module):
         module.fail_json(msg=ex.message)
     api = common.client
 
-    vdc = common.getDTO(vdc_json)
-    if vdc is None:
-        module.fail_json(rc=c, msg="VDC '%s' not found!" % vdc_json['name'])
+    # The catalog only needs the links of the VDC
+    if common.getLink(vdc_json, 'edit') is None or common.getLink(vdc_json, 'templates') is None or params:
+        vdc = common.getDTO(vdc_json)
+        if vdc is None:
+            module.fail_json(msg="VDC '%s' not found!" % vdc_json['name'])
+        vdc_json = vdc.json
 
-    code, templates = vdc.follow('templates').get(params=params)
+    collector = FactsCollector(module, common)
+    result = {}
     try:
-        common.check_response(200, code, templates)
+        if name is not None or template_id is not None:
+            catalog = template_module.get_vdc_template_catalog(common, vdc_json)
+            template = template_module.find_in_catalog(catalog, name, template_id)
+            if template is None:
+                module.fail_json(msg="Template '%s' not found in VDC '%s'" % (name or template_id, vdc_json['name']))
+            result['template_link'] = common.getLink(template, 'edit')
+            templates = [template]
+        elif params:
+            templates = (template.json for template in vdc.follow('templates').iter_collection(params=params))
+        else:
+            templates = template_module.get_vdc_template_catalog(common, vdc_json)['templates']
+
+        for j in templates:
+            j = dict(j, template_link=common.getLink(j, 'edit'))
+            collector.add(j)
     except Exception as ex:
-        module.fail_json(rc=c, msg=ex.message)
-
-    all_templates = []
-    for template in templates:
-        j = template.json
-        j['template_link'] = template._extract_link('edit')
-        all_templates.append(j)
+        module.fail_json(msg=to_native(ex))
 
-    module.exit_json(templates=all_templates)
+    collector.exit_json('templates', **result)
 
 
 def main():
@@ -139,9 +192,13 @@ def main():
     arg_spec.update(
         vdc=dict(default=None, required=True, type='dict'),
         params=dict(default={}, required=False, type='dict'),
+        name=dict(default=None, required=False),
+        id=dict(default=None, required=False),
     )
+    arg_spec.update(facts_argument_spec())
     module = AnsibleModule(
-        argument_spec=arg_spec
+        argument_spec=arg_spec,
+        mutually_exclusive=[['name', 'id'], ['name', 'params'], ['id', 'params']]
     )
 
     try:
@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright: Ansible Project
+# GNU General Public License v3.0+ (see COPYING or
+# https://www.gnu.org/licenses/gpl-3.0.txt)
+
+import traceback
+from ansible.module_utils.abiquo.common import abiquo_argument_spec
+from ansible.module_utils.abiquo.common import AbiquoCommon
+from ansible.module_utils.abiquo.facts import FactsCollector
+from ansible.module_utils.abiquo.facts import facts_argument_spec
+from ansible.module_utils.abiquo.vapp import list_vdc_vapps
+from ansible.module_utils.abiquo.vm import filter_vms_by_tags
+from ansible.module_utils.abiquo.vm import list_vapp_vms
+from ansible.module_utils.abiquo.vm import list_vms
+from ansible.module_utils.abiquo.vm import vm_matches
+from ansible.module_utils.abiquo.vm import vm_query_params
+from ansible.module_utils._text import to_native
+from ansible.module_utils.basic import AnsibleModule
+ANSIBLE_METADATA = {'metadata_version': '0.1',
+                    'status': ['preview'],
+                    'supported_by': 'community'}
+
+
+DOCUMENTATION = '''
+---
+module: abiquo_vm_facts
+short_description: Gather facts on Abiquo virtual machines
+description:
+    - Allows to gather info about the virtual machines of some vApps, of some virtual datacenters or of the whole cloud.
+    - The vApps of the VDCs and the VMs of the vApps are fetched concurrently.
+version_added: "2.4"
+author: "Marc Cirauqui (@chirauki)"
+requirements:
+    - "python >= 2.6"
+    - "abiquo-api >= 0.1.13"
+options:
+    api_url:
+        description:
+          - Define the Abiquo API endpoint URL
+        required: True
+    ssl_verify:
+        description:
+          - Whether or not to verify SSL certificates.
+        required: False
+        default: True
+    api_user:
+        description:
+          - API username
+        required: False
+        default: null
+    api_pass:
+        description:
+          - API password
+        required: False
+        default: null
+    app_key:
+        description:
+          - OAuth1 application key
+        required: False
+        default: null
+    app_secret:
+        description:
+          - OAuth1 application secret
+        required: False
+        default: null
+    token:
+        description:
+          - OAuth1 token
+        required: False
+        default: null
+    token_secret:
+        description:
+          - OAuth1 token secret
+        required: False
+        default: null
+    vapps:
+        description:
+          - If present, only the VMs of these vApps (links or vApp dicts) are returned.
+        required: False
+        default: []
+    vdcs:
+        description:
+          - If present, only the VMs of the vApps of these VDCs (links or VDC dicts) are returned.
+          - If neither vapps nor vdcs are set, all the VMs visible to the user are returned.
+        required: False
+        default: []
+    label:
+        description:
+          - If present, only the VMs with this label are returned. The label is sent to the API as a search term.
+        required: False
+    state:
+        description:
+          - If present, only the VMs in this state (ON, OFF, NOT_ALLOCATED...) are returned.
+          - The API has no state filter for the VM collections, so the state is checked on the controller and every VM matching label and params is still listed.
+        required: False
+    tags:
+        description:
+          - If present, only the VMs having all these tags are returned, along with their 'tags'.
+          - The API cannot filter VMs by tag, and the VM collections do not include the tags. They are fetched with one request per VM, concurrently, for the VMs that passed the other filters.
+        required: False
+        default: {}
+    params:
+        description:
+          - Additional query params for the VM collections, passed as is to the API.
+          - Use them to narrow down the listing with any filter your API version supports, as state and tags are only checked on the controller.
+        required: False
+        default: {}
+    page_size:
+        description:
+          - Number of VMs requested per page. The API default is used if not set.
+        required: False
+        default: null
+extends_documentation_fragment: abiquo_facts
+'''
+
+EXAMPLES = '''
+
+- name: Gather the VMs of a VDC
+  abiquo_vm_facts:
+    api_url: http://localhost:8009/api
+    api_user: admin
+    api_pass: xabiquo
+    vdcs:
+      - "{{ vdc.vdc_link }}"
+
+- name: Gather the VMs powered on and tagged 'env: prod' across the cloud
+  abiquo_vm_facts:
+    api_url: http://localhost:8009/api
+    api_user: admin
+    api_pass: xabiquo
+    state: ON
+    tags:
+      env: prod
+    fields:
+      - label
+      - state
+      - vm_link
+
+'''
+
+RETURN = '''
+vms:
+    description: Returns an array of complex objects as described below.
+    returned: success
+    type: complex
+    contains:
+        id:
+            description: The ID of the VM.
+            returned: always
+            type: string
+        label:
+            description: The label of the VM.
+            returned: always
+            type: string
+        state:
+            description: The state of the VM.
+            returned: always
+            type: string
+        vm_link:
+            description: The link to the VM.
+            returned: always
+            type: dict
+        tags:
+            description: The tags of the VM.
+            returned: when tags is set
+            type: dict
+        links:
+            description: The collection of dicts representing links to related objects.
+            returned: always
+            type: list
+'''
+
+
+def get_dto(common, link_or_entity):
+    if 'href' in link_or_entity:
+        return common.get_dto_from_link(link_or_entity)
+    return common.getDTO(link_or_entity)
+
+
+def core(module):
+    vapp_links = module.params['vapps']
+    vdc_links = module.params['vdcs']
+    label = module.params['label']
+    state = module.params['state']
+    tags = module.params['tags']
+    params = vm_query_params(label, module.params['params'], module.params['page_size'])
+
+    try:
+        common = AbiquoCommon(module)
+    except ValueError as ex:
+        module.fail_json(msg=to_native(ex))
+    api = common.client
+
+    collector = FactsCollector(module, common)
+
+    try:
+        if vapp_links or vdc_links:
+            vapps = [get_dto(common, vapp) for vapp in vapp_links]
+            vdcs = [get_dto(common, vdc) for vdc in vdc_links]
+            vapps.extend(list_vdc_vapps(common, vdcs))
+            vms = list_vapp_vms(common, vapps, params)
+        else:
+            vms = list_vms(api.cloud.virtualmachines, params)
+
+        vms = (vm for vm in vms if vm_matches(vm, label, state))
+        if tags:
+            vms = filter_vms_by_tags(common, vms, tags)
+        else:
+            vms = ((vm, None) for vm in vms)
+
+        for vm, vm_tags in vms:
+            j = vm.json
+            j['vm_link'] = vm._extract_link('edit')
+            if vm_tags is not None:
+                j['tags'] = vm_tags
+            collector.add(j)
+    except Exception as ex:
+        module.fail_json(msg=to_native(ex))
+
+    collector.exit_json('vms')
+
+
+def main():
+    arg_spec = abiquo_argument_spec()
+    arg_spec.update(
+        vapps=dict(default=[], required=False, type='list'),
+        vdcs=dict(default=[], required=False, type='list'),
+        label=dict(default=None, required=False),
+        state=dict(default=None, required=False),
+        tags=dict(default={}, required=False, type='dict'),
+        params=dict(default={}, required=False, type='dict'),
+        page_size=dict(default=None, required=False, type='int'),
+    )
+    arg_spec.update(facts_argument_spec())
+    module = AnsibleModule(
+        argument_spec=arg_spec
+    )
+
+    try:
+        core(module)
+    except Exception as e:
+        module.fail_json(
+            msg='Unanticipated error running abiquo_vm_facts: %s' %
+            to_native(e), exception=traceback.format_exc())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+import threading
+import time
+
+
+def percentile(samples, pct):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    index = int(round((pct / 100.0) * (len(ordered) - 1)))
+    return ordered[index]
+
+
+class AimdLimiter(object):
+    '''Concurrency limit driven by the latency and status of API requests.
+
+    The limit grows by one after every window of requests that completes with a
+    healthy p95 latency and error rate, and is multiplied by `decrease_factor`
+    when the API answers 429 or 5xx, a connection fails, or the window p95 goes
+    above `latency_factor` times the best p95 observed so far.
+    '''
+
+    def __init__(self, initial=2, minimum=1, maximum=16, decrease_factor=0.5,
+                 latency_factor=2.0, max_error_rate=0.05, window=20):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.limit = min(max(initial, self.minimum), self.maximum)
+        self.decrease_factor = decrease_factor
+        self.latency_factor = latency_factor
+        self.max_error_rate = max_error_rate
+        self.window = window
+
+        self._lock = threading.Lock()
+        self._samples = []
+        self._errors = 0
+        self._baseline = None
+        self._last_decrease = 0
+
+    def observe(self, latency, status):
+        with self._lock:
+            failed = status is None or status == 429 or status >= 500
+            if failed:
+                self._errors += 1
+                self._decrease()
+                return
+
+            self._samples.append(latency)
+            if len(self._samples) < max(self.window, self.limit):
+                return
+
+            p95 = percentile(self._samples, 95)
+            error_rate = float(self._errors) / (len(self._samples) + self._errors)
+            if self._baseline is None or p95 < self._baseline:
+                self._baseline = p95
+            else:
+                # Let the baseline follow a slower API instead of pinning the
+                # limit down forever after one unusually fast window.
+                self._baseline *= 1.05
+
+            if p95 > self.latency_factor * self._baseline:
+                self._decrease()
+            elif error_rate <= self.max_error_rate:
+                self.limit = min(self.limit + 1, self.maximum)
+            self._reset_window()
+
+    def _decrease(self):
+        # In-flight requests fail together, only back off once per round trip.
+        cooldown = self._baseline if self._baseline is not None else 1.0
+        now = time.time()
+        if now - self._last_decrease < cooldown:
+            return
+        self._last_decrease = now
+        self.limit = max(self.minimum, int(self.limit * self.decrease_factor))
+        self._reset_window()
+
+    def _reset_window(self):
+        self._samples = []
+        self._errors = 0
+
+
+def bulk_map(func, items, limiter):
+    '''Applies func to every item with at most `limiter.limit` calls running.
+
+    Returns one (ok, value) tuple per item, in input order, where value is
+    either what func returned or the exception it raised.
+    '''
+    items = list(items)
+    results = [None] * len(items)
+    cond = threading.Condition()
+    state = {'next': 0, 'active': 0}
+
+    def worker():
+        while True:
+            with cond:
+                while state['active'] >= limiter.limit and state['next'] < len(items):
+                    cond.wait(0.5)
+                if state['next'] >= len(items):
+                    return
+                index = state['next']
+                state['next'] += 1
+                state['active'] += 1
+            try:
+                results[index] = (True, func(items[index]))
+            except Exception as ex:
+                results[index] = (False, ex)
+            finally:
+                with cond:
+                    state['active'] -= 1
+                    cond.notify_all()
+
+    workers = []
+    for i in range(min(limiter.maximum, len(items))):
+        thread = threading.Thread(target=worker)
+        thread.daemon = True
+        thread.start()
+        workers.append(thread)
+    for thread in workers:
+        thread.join()
+
+    return results
@@ -0,0 +1,107 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+
+def write_atomically(path, data):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)),
+                                    prefix='.%s.' % os.path.basename(path))
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    os.rename(tmp_path, path)
+
+
+# Shared by every Cache of the process, so values survive the AbiquoCommon
+# instances created along one module run.
+_memory = {}
+_memory_lock = threading.Lock()
+
+
+class Cache(object):
+    '''Memoizes API lookups.
+
+    Values are kept in memory for the run and, if a directory is given,
+    stored there as JSON so later module runs can reuse them for `ttl`
+    seconds. Keys are scoped by `namespace`, the API endpoint and user the
+    values were read with.
+    '''
+
+    def __init__(self, namespace, directory=None, ttl=300):
+        self.namespace = namespace
+        self.directory = directory
+        self.ttl = ttl
+
+    def scoped(self, key):
+        return '%s|%s' % (self.namespace, key)
+
+    def path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.json')
+
+    def get(self, key, loader):
+        '''Returns the cached value for key, calling loader() to build it if missing or expired.'''
+        entry = self.get_entry(key)
+        if entry is not None:
+            return entry['value']
+        value = loader()
+        self.set(key, value)
+        return value
+
+    def get_entry(self, key, allow_expired=False):
+        '''Returns the {'stored_at', 'value', ...} entry for key, or None.
+
+        Values already used in this run are always valid, the ones read
+        from disk only until they are `ttl` seconds old.
+        '''
+        key = self.scoped(key)
+        with _memory_lock:
+            entry = _memory.get(key)
+        if entry is not None or self.directory is None:
+            return entry
+
+        entry = self.read(key)
+        if entry is None:
+            return None
+        if time.time() - entry['stored_at'] >= self.ttl:
+            return entry if allow_expired else None
+        with _memory_lock:
+            _memory[key] = entry
+        return entry
+
+    def set(self, key, value, stored_at=None, **extra):
+        '''Stores value for key. Passing the stored_at of the entry it replaces keeps its age.'''
+        key = self.scoped(key)
+        entry = dict(extra, stored_at=stored_at or time.time(), value=value)
+        with _memory_lock:
+            _memory[key] = entry
+        if self.directory is not None and self.ttl > 0:
+            self.write(key, entry)
+
+    def invalidate(self, key):
+        key = self.scoped(key)
+        with _memory_lock:
+            _memory.pop(key, None)
+        if self.directory is not None:
+            try:
+                os.remove(self.path(key))
+            except OSError:
+                pass
+
+    def read(self, key):
+        try:
+            with open(self.path(key), 'rb') as f:
+                entry = json.loads(f.read().decode('utf-8'))
+        except (IOError, OSError, ValueError):
+            return None
+        # Guards against hash collisions and files from other versions
+        if not isinstance(entry, dict) or entry.get('key') != key:
+            return None
+        return entry
+
+    def write(self, key, entry):
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory, 0o700)
+        data = json.dumps(dict(entry, key=key))
+        write_atomically(self.path(key), data.encode('utf-8'))
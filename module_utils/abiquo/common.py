@@ -1,19 +1,59 @@
 from abiquo.client import Abiquo
+from abiquo.client import ObjectDto
 from abiquo.client import check_response
 from requests_oauthlib import OAuth1
 from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.abiquo.bulk import AimdLimiter
+from ansible.module_utils.abiquo.bulk import bulk_map
+from ansible.module_utils.abiquo.cache import Cache
+import email.utils
 import json
+import requests
 import urllib3
 import os
 import re
 import time
 import copy
+import threading
 
 try:
     from http.client import HTTPConnection  # py3
 except ImportError:
     from httplib import HTTPConnection  # py2
 
+try:
+    import orjson
+    HAS_ORJSON = True
+except ImportError:
+    HAS_ORJSON = False
+
+try:
+    import ijson
+    HAS_IJSON = True
+except ImportError:
+    HAS_IJSON = False
+
+
+def json_loads(data):
+    if HAS_ORJSON:
+        return orjson.loads(data)
+    if isinstance(data, bytes):
+        data = data.decode('utf-8')
+    return json.loads(data)
+
+
+def json_dumps(obj, sort_keys=False):
+    if HAS_ORJSON:
+        option = orjson.OPT_NON_STR_KEYS
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        try:
+            return orjson.dumps(obj, option=option)
+        except TypeError:
+            # Values orjson refuses, such as integers over 64 bits
+            pass
+    return json.dumps(obj, sort_keys=sort_keys)
+
 
 def abiquo_argument_spec():
     return dict(
@@ -27,6 +67,14 @@ def abiquo_argument_spec():
         abiquo_token_secret=dict(default=None, required=False, no_log=True),
         abiquo_max_attempts=dict(default=30, required=False, type='int'),
         abiquo_retry_delay=dict(default=10, required=False, type='int'),
+        abiquo_max_concurrency=dict(default=16, required=False, type='int'),
+        abiquo_connect_timeout=dict(default=10, required=False, type='float'),
+        abiquo_read_timeout=dict(default=120, required=False, type='float'),
+        abiquo_endpoint_timeouts=dict(default=None, required=False, type='dict'),
+        abiquo_request_retries=dict(default=3, required=False, type='int'),
+        abiquo_metrics=dict(default=False, required=False, type='bool'),
+        abiquo_cache_dir=dict(default=None, required=False, type='path'),
+        abiquo_cache_ttl=dict(default=300, required=False, type='int'),
         links=dict(default=None, required=False, type=dict)
     )
 
@@ -40,6 +88,325 @@ def abiquo_updatable_arguments(args):
     return updatable_args
 
 
+def abiquo_exit_json(module, **result):
+    if module.params.get('abiquo_metrics'):
+        result['abiquo_metrics'] = request_metrics()
+    module.exit_json(**result)
+
+
+_request_listeners = []
+_metrics = {
+    'requests': 0,
+    'compressed_responses': 0,
+    'wire_bytes': 0,
+    'decoded_bytes': 0,
+    'elapsed': 0.0,
+}
+_metrics_lock = threading.Lock()
+
+
+def add_request_listener(listener):
+    _request_listeners.append(listener)
+
+
+def remove_request_listener(listener):
+    _request_listeners.remove(listener)
+
+
+def record_transfer(wire_bytes, decoded_bytes, elapsed, compressed):
+    with _metrics_lock:
+        _metrics['requests'] += 1
+        _metrics['wire_bytes'] += wire_bytes
+        _metrics['decoded_bytes'] += decoded_bytes
+        _metrics['elapsed'] += elapsed
+        if compressed:
+            _metrics['compressed_responses'] += 1
+
+
+def request_metrics():
+    with _metrics_lock:
+        metrics = dict(_metrics)
+    metrics['elapsed'] = round(metrics['elapsed'], 3)
+    metrics['compression_ratio'] = None
+    if metrics['wire_bytes'] > 0:
+        metrics['compression_ratio'] = round(float(metrics['decoded_bytes']) / metrics['wire_bytes'], 2)
+    return metrics
+
+
+class CountingReader(object):
+    def __init__(self, stream):
+        self.stream = stream
+        self.count = 0
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        self.count += len(data)
+        return data
+
+
+def iter_collection_page(stream):
+    '''Parses a collection page incrementally.
+
+    Yields ('item', entity) for each element of the collection and
+    ('link', link) for each link of the page, as soon as they are read.
+    '''
+    builder = None
+    target = None
+    for prefix, event, value in ijson.parse(stream, use_float=True):
+        if builder is None:
+            if event == 'start_map' and prefix in ('collection.item', 'links.item'):
+                builder = ijson.common.ObjectBuilder()
+                target = prefix
+                builder.event(event, value)
+            continue
+
+        builder.event(event, value)
+        if event == 'end_map' and prefix == target:
+            yield ('item' if target == 'collection.item' else 'link'), builder.value
+            builder = None
+
+
+class AbiquoTransport(object):
+    '''HTTP session shared by every client and DTO built from one AbiquoCommon.'''
+
+    # Read timeouts for endpoints known to take longer than a regular request
+    ENDPOINT_READ_TIMEOUTS = {
+        'upload': 3600,
+        'discover': 600,
+    }
+    IDEMPOTENT_METHODS = ['get', 'head', 'options', 'put', 'delete']
+    # The API rejected the request without processing it, any method can be
+    # replayed. A 503 may come from a proxy after the API got the request.
+    THROTTLED_STATUS = 429
+    MAX_RETRY_AFTER = 60
+
+    def __init__(self, pool_size=10, connect_timeout=10, read_timeout=120,
+                 endpoint_timeouts=None, retries=3):
+        self.session = requests.Session()
+        self.session.headers['Accept-Encoding'] = 'gzip, deflate'
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.endpoint_timeouts = dict(self.ENDPOINT_READ_TIMEOUTS)
+        self.endpoint_timeouts.update(endpoint_timeouts or {})
+        self.retries = max(retries, 0)
+
+    def timeout(self, endpoint=None):
+        return (self.connect_timeout, self.endpoint_timeouts.get(endpoint, self.read_timeout))
+
+    def request(self, method, url, endpoint=None, **kwargs):
+        kwargs.setdefault('timeout', self.timeout(endpoint))
+        for attempt in range(self.retries + 1):
+            start = time.time()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as ex:
+                self.notify(time.time() - start, None)
+                if not self.is_retryable(method, ex) or attempt == self.retries:
+                    raise
+                # The stalled connection has been dropped from the pool, the
+                # next attempt opens a fresh one.
+                time.sleep(min(0.5 * 2 ** attempt, 5))
+                continue
+            elapsed = time.time() - start
+            self.notify(elapsed, response.status_code)
+            if attempt < self.retries and self.is_retryable_status(method, response.status_code):
+                delay = self.retry_delay(response, attempt)
+                response.close()
+                time.sleep(delay)
+                continue
+            if not kwargs.get('stream'):
+                self.record(response, elapsed)
+            return response
+
+    def record(self, response, elapsed):
+        decoded_bytes = len(response.content)
+        try:
+            # Bytes read from the socket, before gzip/deflate decoding
+            wire_bytes = response.raw.tell()
+        except AttributeError:
+            wire_bytes = decoded_bytes
+        compressed = response.headers.get('content-encoding') in ('gzip', 'deflate')
+        record_transfer(wire_bytes, decoded_bytes, elapsed, compressed)
+
+    def is_retryable(self, method, ex):
+        # Nothing reached the server, safe to replay any request
+        if isinstance(ex, requests.exceptions.ConnectTimeout):
+            return True
+        return method.lower() in self.IDEMPOTENT_METHODS
+
+    def is_retryable_status(self, method, status):
+        if status == self.THROTTLED_STATUS:
+            return True
+        return status >= 500 and method.lower() in self.IDEMPOTENT_METHODS
+
+    def retry_delay(self, response, attempt):
+        '''Seconds to wait before retrying, as asked by Retry-After or with exponential backoff.'''
+        retry_after = response.headers.get('Retry-After')
+        if retry_after:
+            try:
+                return min(max(float(retry_after), 0), self.MAX_RETRY_AFTER)
+            except ValueError:
+                date = email.utils.parsedate_tz(retry_after)
+                if date is not None:
+                    return min(max(email.utils.mktime_tz(date) - time.time(), 0), self.MAX_RETRY_AFTER)
+        return min(0.5 * 2 ** attempt, 5)
+
+    def notify(self, latency, status):
+        for listener in list(_request_listeners):
+            listener(latency, status)
+
+
+class AbiquoClient(Abiquo):
+    def __init__(self, url, auth=None, headers=None, verify=True, transport=None, endpoint=None):
+        self.url = url
+        self.auth = auth
+        self.headers = {url: headers}
+        self.verify = verify
+        self.transport = transport if transport is not None else AbiquoTransport()
+        self.endpoint = endpoint
+
+    def __getattr__(self, key):
+        try:
+            return self.__dict__[key]
+        except KeyError:
+            self.__dict__[key] = self._child(self._join(self.url, key))
+            return self.__dict__[key]
+
+    def __call__(self, *args):
+        if not args:
+            return self
+        return self._child(self._join(self.url, *[str(i) for i in args]))
+
+    def _child(self, url, headers=None):
+        return AbiquoClient(url, auth=self.auth, headers=headers, verify=self.verify,
+                            transport=self.transport)
+
+    def for_endpoint(self, endpoint):
+        '''Returns this client using the timeouts configured for endpoint.'''
+        return AbiquoClient(self.url, auth=self.auth, headers=self.headers[self.url],
+                            verify=self.verify, transport=self.transport, endpoint=endpoint)
+
+    def _request(self, method, url, params=None, headers=None, data=None):
+        parent_headers = self.headers[url] if url in self.headers else {}
+        response = self.transport.request(method,
+                                          url,
+                                          endpoint=self.endpoint,
+                                          auth=self.auth,
+                                          params=params,
+                                          data=data,
+                                          verify=self.verify,
+                                          headers=self._merge_dicts(parent_headers, headers))
+        response_dto = None
+        if len(response.content) > 0:
+            try:
+                response_dto = AbiquoDto(json_loads(response.content), auth=self.auth,
+                                         content_type=response.headers.get('content-type', None),
+                                         verify=self.verify, transport=self.transport,
+                                         etag=response.headers.get('etag'))
+            except ValueError:
+                pass
+        return response.status_code, response_dto
+
+    def iter_collection(self, params=None, headers=None):
+        '''Yields the entities of a collection one by one, following its pages.
+
+        When ijson is available each page is parsed while it is read from the
+        socket, so memory stays bounded and the rest of the response is not
+        downloaded once the caller stops iterating.
+        '''
+        if not HAS_IJSON:
+            code, page = self.get(params=params, headers=headers)
+            check_response(200, code, page)
+            for dto in page:
+                yield dto
+            return
+
+        url = self.url
+        headers = self._merge_dicts(self.headers[self.url], headers)
+        while url is not None:
+            start = time.time()
+            response = self.transport.request('get', url,
+                                              endpoint=self.endpoint,
+                                              auth=self.auth,
+                                              params=params,
+                                              verify=self.verify,
+                                              headers=headers,
+                                              stream=True)
+            try:
+                if response.status_code != 200:
+                    errors = None
+                    if len(response.content) > 0:
+                        errors = AbiquoDto(json_loads(response.content))
+                    check_response(200, response.status_code, errors)
+
+                response.raw.decode_content = True
+                reader = CountingReader(response.raw)
+                next_link = None
+                for kind, value in iter_collection_page(reader):
+                    if kind == 'item':
+                        yield AbiquoDto(value, auth=self.auth, verify=self.verify, transport=self.transport)
+                    elif value.get('rel') == 'next':
+                        next_link = value
+
+                record_transfer(response.raw.tell(), reader.count, time.time() - start,
+                                response.headers.get('content-encoding') in ('gzip', 'deflate'))
+            finally:
+                response.close()
+
+            url = None
+            if next_link is not None:
+                url = next_link['href']
+                params = None
+                headers = self._merge_dicts(headers, {'accept': next_link.get(
+                    'type', response.headers.get('content-type'))})
+
+
+class AbiquoDto(ObjectDto):
+    def __init__(self, json, auth=None, content_type=None, verify=True, transport=None, etag=None):
+        # Set before the JSON, afterwards unknown attributes go into the DTO
+        self.transport = transport
+        self.etag = etag
+        super(AbiquoDto, self).__init__(json, auth=auth, content_type=content_type, verify=verify)
+
+    def put(self, params=None):
+        if not self._has_link('edit'):
+            raise TypeError('object is not editable')
+        link_type = self._extract_link('edit')['type']
+        return self.follow('edit').put(params=params, headers={'Content-Type': link_type},
+                                       data=json_dumps(self.json))
+
+    def follow(self, rel):
+        link = self._extract_link(rel)
+        if not link:
+            raise KeyError("link with rel %s not found" % rel)
+        return AbiquoClient(link['href'], auth=self.auth, headers={'accept': link['type']},
+                            verify=self.verify, transport=self.transport)
+
+    def __iter__(self):
+        try:
+            for item in self.json['collection']:
+                yield AbiquoDto(item, auth=self.auth, verify=self.verify, transport=self.transport)
+
+            current_page = self
+            while current_page._has_link('next'):
+                link = current_page._extract_link('next')
+                client = AbiquoClient(link['href'],
+                                      auth=self.auth,
+                                      headers={'Accept': link.get('type', self.content_type)},
+                                      verify=self.verify,
+                                      transport=self.transport)
+                sc, current_page = client.get()
+                if sc != 200 or not current_page:
+                    break
+                for item in current_page.json['collection']:
+                    yield AbiquoDto(item, auth=self.auth, verify=self.verify, transport=self.transport)
+        except KeyError:
+            raise TypeError('object is not iterable')
+
+
 class AbiquoCommon(object):
     NETWORK_SYS_PROPS = [
         "client.network.numberIpAdressesPerPage",
@@ -61,6 +428,7 @@ class AbiquoCommon(object):
         app_secret = ansible_module.params.get('abiquo_app_secret')
         token = ansible_module.params.get('abiquo_token')
         token_secret = ansible_module.params.get('abiquo_token_secret')
+        self.max_concurrency = ansible_module.params.get('abiquo_max_concurrency') or 16
 
         # API URL
         if not api_url:
@@ -111,7 +479,18 @@ class AbiquoCommon(object):
         else:
             raise ValueError('Either basic auth or OAuth creds are required.')
 
-        self.client = Abiquo(api_url, auth=creds, verify=verify)
+        transport = AbiquoTransport(
+            pool_size=max(self.max_concurrency, 10),
+            connect_timeout=ansible_module.params.get('abiquo_connect_timeout') or 10,
+            read_timeout=ansible_module.params.get('abiquo_read_timeout') or 120,
+            endpoint_timeouts=ansible_module.params.get('abiquo_endpoint_timeouts'),
+            retries=ansible_module.params.get('abiquo_request_retries') or 0)
+        self.client = AbiquoClient(api_url, auth=creds, verify=verify, transport=transport)
+
+        cache_ttl = ansible_module.params.get('abiquo_cache_ttl')
+        self.cache = Cache('%s|%s' % (api_url, api_user or app_key),
+                           directory=ansible_module.params.get('abiquo_cache_dir'),
+                           ttl=300 if cache_ttl is None else cache_ttl)
         if not verify:
             urllib3.disable_warnings()
         self.user = None
@@ -123,6 +502,28 @@ class AbiquoCommon(object):
         '''Switches on logging of the requests module.'''
         HTTPConnection.debuglevel = 1
 
+    def bulk_map(self, func, items):
+        '''Runs func over items concurrently, adapting the pool size to the API.'''
+        limiter = AimdLimiter(maximum=self.max_concurrency)
+        add_request_listener(limiter.observe)
+        try:
+            return bulk_map(func, items, limiter)
+        finally:
+            remove_request_listener(limiter.observe)
+
+    def get_all(self, requests):
+        '''GETs several independent resources concurrently.
+
+        Each request is a (client, kwargs) tuple, kwargs being passed to
+        client.get(). Returns the (code, dto) of each request, in order.
+        '''
+        responses = []
+        for ok, value in self.bulk_map(lambda request: request[0].get(**request[1]), requests):
+            if not ok:
+                raise value
+            responses.append(value)
+        return responses
+
     def check_response(self, expected, code, dto):
         return check_response(expected, code, dto)
 
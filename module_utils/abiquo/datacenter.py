@@ -1,6 +1,5 @@
-import json
-
 from ansible.module_utils.abiquo.common import AbiquoCommon
+from ansible.module_utils.abiquo.common import json_dumps
 from abiquo.client import check_response
 
 
@@ -68,7 +67,7 @@ def create_rack(datacenter, module):
     code, rack = datacenter.follow('racks').post(
         headers={'accept': 'application/vnd.abiquo.rack+json',
                  'content-type': 'application/vnd.abiquo.rack+json'},
-        data=json.dumps(rackjson)
+        data=json_dumps(rackjson)
     )
     check_response(201, code, rack)
 
@@ -76,7 +75,7 @@ def create_rack(datacenter, module):
 
 
 def discover(dc, disc_query_params):
-    c, hypdisc = dc.follow('discover').get(params=disc_query_params)
+    c, hypdisc = dc.follow('discover').for_endpoint('discover').get(params=disc_query_params)
     check_response(200, c, hypdisc)
     return hypdisc.collection[0]
 
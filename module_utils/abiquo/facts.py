@@ -0,0 +1,339 @@
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+
+from ansible.module_utils.abiquo.cache import write_atomically
+from ansible.module_utils.abiquo.common import abiquo_exit_json
+from ansible.module_utils.abiquo.common import AbiquoCommon
+from ansible.module_utils.abiquo.common import json_dumps
+from ansible.module_utils.abiquo.common import json_loads
+
+
+def facts_argument_spec():
+    return dict(
+        fields=dict(default=None, required=False, type='list'),
+        output_format=dict(default='list', required=False, choices=['list', 'columnar']),
+        output_file=dict(default=None, required=False, type='path'),
+        output_compress=dict(default=False, required=False, type='bool'),
+        since_state=dict(default=None, required=False, type='path'),
+        expand=dict(default=None, required=False, type='list'),
+        expand_mode=dict(default='table', required=False, choices=['table', 'embed']),
+    )
+
+
+def compile_fields(fields):
+    '''Turns ['id', 'links.edit.href'] into {'id': {}, 'links': {'edit': {'href': {}}}}.
+
+    An empty dict selects the whole value.
+    '''
+    if not fields:
+        return None
+
+    tree = {}
+    for field in fields:
+        node = tree
+        for part in field.split('.'):
+            if part not in node:
+                node[part] = {}
+            elif not node[part]:
+                # A shorter path already selects the whole value
+                break
+            node = node[part]
+        else:
+            node.clear()
+    return tree
+
+
+def project(value, tree):
+    if not tree:
+        return value
+
+    if isinstance(value, dict):
+        return dict((k, project(value[k], sub)) for k, sub in tree.items() if k in value)
+
+    if isinstance(value, list):
+        projected = []
+        for item in value:
+            if isinstance(item, dict) and 'rel' in item:
+                # Links are selected by rel: links.edit, links.edit.href
+                if item['rel'] in tree:
+                    projected.append(project(item, tree[item['rel']]))
+            else:
+                projected.append(project(item, tree))
+        return projected
+
+    return value
+
+
+def is_link(value):
+    return isinstance(value, dict) and 'href' in value
+
+
+class ColumnarTable(object):
+    '''Stores entities as rows of a table instead of a list of dicts.
+
+    Each key is stored once in the columns, and every distinct link once in the
+    links table; rows reference links by their position in that table.
+    '''
+
+    def __init__(self):
+        self.columns = []
+        self.column_index = {}
+        self.rows = []
+        self.links = []
+        self.link_index = {}
+
+    def add(self, entity):
+        row = [None] * len(self.columns)
+        for key, value in entity.items():
+            if key not in self.column_index:
+                self.column_index[key] = len(self.columns)
+                self.columns.append(key)
+                row.append(None)
+            row[self.column_index[key]] = self.intern(value)
+        self.rows.append(row)
+
+    def intern(self, value):
+        if is_link(value):
+            return self.intern_link(value)
+        if isinstance(value, list) and value and all(is_link(v) for v in value):
+            return [self.intern_link(v) for v in value]
+        return value
+
+    def intern_link(self, link):
+        key = json.dumps(link, sort_keys=True)
+        if key not in self.link_index:
+            self.link_index[key] = len(self.links)
+            self.links.append(link)
+        return self.link_index[key]
+
+    def result(self):
+        # Columns found after a row was added are missing at the end of it
+        for row in self.rows:
+            row.extend([None] * (len(self.columns) - len(row)))
+        return {'columns': self.columns, 'rows': self.rows, 'links': self.links}
+
+
+class HashingWriter(object):
+    def __init__(self, stream):
+        self.stream = stream
+        self.sha256 = hashlib.sha256()
+
+    def write(self, data):
+        self.sha256.update(data)
+        return self.stream.write(data)
+
+    def flush(self):
+        self.stream.flush()
+
+
+class NdjsonSpool(object):
+    '''Writes entities to a file, one JSON document per line.
+
+    The file is written next to its final path and only moved there when
+    complete, and its SHA-256 is computed while it is written.
+    '''
+
+    def __init__(self, path, compress=False):
+        self.path = path
+        self.count = 0
+        fd, self.tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)),
+                                             prefix='.%s.' % os.path.basename(path))
+        # mkstemp creates the file readable only by the owner
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(self.tmp_path, 0o666 & ~umask)
+        self.raw = os.fdopen(fd, 'wb')
+        self.writer = HashingWriter(self.raw)
+        self.stream = self.writer
+        if compress:
+            self.stream = gzip.GzipFile(filename='', mode='wb', fileobj=self.writer)
+
+    def add(self, entity):
+        line = json_dumps(entity)
+        if not isinstance(line, bytes):
+            line = line.encode('utf-8')
+        self.stream.write(line + b'\n')
+        self.count += 1
+
+    def close(self):
+        if self.stream is not self.writer:
+            self.stream.close()
+        self.raw.close()
+        os.rename(self.tmp_path, self.path)
+        return {'path': self.path, 'count': self.count, 'checksum': self.writer.sha256.hexdigest()}
+
+
+def entity_key(entity):
+    for link in entity.get('links', []):
+        if link.get('rel') in ('edit', 'self'):
+            return link['href']
+    return str(entity.get('id'))
+
+
+def entity_hash(entity):
+    data = json_dumps(entity, sort_keys=True)
+    if not isinstance(data, bytes):
+        data = data.encode('utf-8')
+    return hashlib.sha1(data).hexdigest()
+
+
+class DeltaTracker(object):
+    '''Compares the entities of this run with the snapshot of the previous one.
+
+    The snapshot maps the href of each entity to a hash of its (projected)
+    JSON, so only entities that were added or changed need to be returned.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.previous = None
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                self.previous = json_loads(f.read())['entities']
+        self.current = {}
+        self.added = []
+        self.changed = []
+
+    def check(self, key, entity):
+        digest = entity_hash(entity)
+        self.current[key] = digest
+        if self.previous is None or key not in self.previous:
+            self.added.append(key)
+            return True
+        if self.previous[key] != digest:
+            self.changed.append(key)
+            return True
+        return False
+
+    def save(self):
+        data = json_dumps({'entities': self.current})
+        if not isinstance(data, bytes):
+            data = data.encode('utf-8')
+        write_atomically(self.path, data)
+
+        removed = []
+        if self.previous is not None:
+            removed = [key for key in self.previous if key not in self.current]
+        return {
+            'path': self.path,
+            'first_run': self.previous is None,
+            'added': self.added,
+            'changed': self.changed,
+            'removed': removed,
+            'unchanged': len(self.current) - len(self.added) - len(self.changed),
+        }
+
+
+class LinkExpander(object):
+    '''Fetches the entities linked from other entities with the given rels.
+
+    Each distinct href is fetched once, however many entities link to it, and
+    the hrefs of a batch of entities are fetched concurrently.
+    '''
+
+    def __init__(self, common, rels):
+        self.common = common
+        self.rels = set(rels)
+        self.entities = {}
+
+    def links(self, entity):
+        return [link for link in entity.get('links', []) if link.get('rel') in self.rels]
+
+    def fetch(self, links):
+        pending = {}
+        for link in links:
+            if link['href'] not in self.entities:
+                pending[link['href']] = link
+        pending = list(pending.values())
+
+        results = self.common.bulk_map(lambda link: self.common.get_dto_from_link(link).json, pending)
+        for link, (ok, value) in zip(pending, results):
+            if not ok:
+                raise Exception("Could not expand link '%s': %s" % (link['href'], value))
+            self.entities[link['href']] = value
+
+
+class FactsCollector(object):
+    '''Accumulates the entities returned by a facts module.
+
+    Entities are reduced to the requested fields as they are added, so the
+    full JSON of each entity is released as soon as it has been read.
+    '''
+
+    # Entities whose links are expanded together
+    EXPAND_BATCH = 200
+
+    def __init__(self, module, common=None):
+        self.module = module
+        self.fields = compile_fields(module.params.get('fields'))
+        self.entities = []
+        self.table = None
+        self.spool = None
+        self.delta = None
+        self.expander = None
+        self.pending = []
+        if module.params.get('expand'):
+            self.expander = LinkExpander(common or AbiquoCommon(module), module.params['expand'])
+        if module.params.get('since_state') is not None:
+            self.delta = DeltaTracker(module.params['since_state'])
+        if module.params.get('output_file') is not None:
+            if module.params.get('output_format') == 'columnar':
+                module.fail_json(msg="output_file cannot be used with the columnar output format.")
+            self.spool = NdjsonSpool(module.params['output_file'], module.params.get('output_compress'))
+            # Removes the partial file if the module fails
+            module.add_cleanup_file(self.spool.tmp_path)
+        elif module.params.get('output_format') == 'columnar':
+            self.table = ColumnarTable()
+
+    def add(self, entity):
+        key = entity_key(entity)
+        # Links are picked before the projection, which may leave them out
+        links = self.expander.links(entity) if self.expander is not None else None
+        entity = project(entity, self.fields)
+        if self.delta is not None and not self.delta.check(key, entity):
+            return
+
+        if self.expander is None:
+            self.emit(entity)
+            return
+        self.pending.append((entity, links))
+        if len(self.pending) >= self.EXPAND_BATCH:
+            self.flush()
+
+    def flush(self):
+        self.expander.fetch(link for entity, links in self.pending for link in links)
+        for entity, links in self.pending:
+            if self.module.params.get('expand_mode') == 'embed':
+                entity['expanded'] = dict((link['rel'], self.expander.entities[link['href']]) for link in links)
+            self.emit(entity)
+        self.pending = []
+
+    def emit(self, entity):
+        if self.spool is not None:
+            self.spool.add(entity)
+        elif self.table is not None:
+            self.table.add(entity)
+        else:
+            self.entities.append(entity)
+
+    def result(self):
+        if self.table is not None:
+            return self.table.result()
+        return self.entities
+
+    def exit_json(self, key, **result):
+        if self.expander is not None:
+            self.flush()
+            if self.module.params.get('expand_mode') == 'table':
+                result['expanded'] = self.expander.entities
+        if self.spool is not None:
+            result['output_file'] = self.spool.close()
+        else:
+            result[key] = self.result()
+        # Only once the entities are delivered, or the next run would skip them
+        if self.delta is not None:
+            result['delta'] = self.delta.save()
+        abiquo_exit_json(self.module, **result)
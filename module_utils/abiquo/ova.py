@@ -0,0 +1,571 @@
+import fcntl
+import hashlib
+import json
+import os
+import re
+import tarfile
+import threading
+import time
+import uuid
+
+import requests
+from xml.etree import ElementTree
+
+from ansible.module_utils.abiquo.cache import write_atomically
+
+
+class TokenBucket(object):
+    '''Bandwidth budget shared by concurrent uploads, in bytes per second.'''
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst or rate)
+        self.tokens = self.burst
+        self.updated = time.time()
+        self.lock = threading.Lock()
+
+    def consume(self, amount):
+        while amount > 0:
+            # Large reads are split so they never need more than the burst
+            chunk = min(amount, self.burst)
+            with self.lock:
+                now = time.time()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                self.tokens -= chunk
+                wait = -self.tokens / self.rate if self.tokens < 0 else 0
+            if wait > 0:
+                time.sleep(wait)
+            amount -= chunk
+
+
+class TransferProgress(object):
+    '''Bytes sent by concurrent transfers, overall and per transfer.
+
+    If a path is given, the progress is written there as JSON at most every
+    `interval` seconds and whenever a transfer ends, so it can be followed
+    from outside while the module runs.
+    '''
+
+    def __init__(self, path=None, interval=1.0):
+        self.path = path
+        self.interval = interval
+        self.started = time.time()
+        self.written = 0
+        self.transfers = {}
+        self.lock = threading.Lock()
+
+    def start(self, key, size):
+        with self.lock:
+            self.transfers[key] = {'size': size, 'sent': 0, 'state': 'RUNNING'}
+        self.write()
+
+    def advance(self, key, amount):
+        with self.lock:
+            self.transfers[key]['sent'] += amount
+        if time.time() - self.written >= self.interval:
+            self.write()
+
+    def finish(self, key, state):
+        with self.lock:
+            self.transfers[key]['state'] = state
+        self.write()
+
+    def summary(self):
+        with self.lock:
+            transfers = dict((key, dict(value)) for key, value in self.transfers.items())
+        elapsed = time.time() - self.started
+        sent = sum(t['sent'] for t in transfers.values())
+        return {
+            'total_bytes': sum(t['size'] for t in transfers.values()),
+            'sent_bytes': sent,
+            'elapsed_seconds': round(elapsed, 3),
+            'bytes_per_second': int(sent / elapsed) if elapsed > 0 else 0,
+            'transfers': transfers,
+        }
+
+    def write(self):
+        if self.path is None:
+            return
+        self.written = time.time()
+        write_atomically(self.path, json.dumps(self.summary()).encode('utf-8'))
+
+
+class MultipartFile(object):
+    '''multipart/form-data body with one file field, read from disk as it is sent.
+
+    requests streams file-like bodies that know their length, so the file is
+    never held in memory whatever its size. The SHA-256 and size of the file
+    are computed while it is read.
+    '''
+
+    def __init__(self, field, path, filename=None, content_type='application/octet-stream', throttle=None,
+                 progress=None):
+        self.throttle = throttle
+        self.progress = progress
+        self.boundary = uuid.uuid4().hex
+        self.path = path
+        self.file_size = os.path.getsize(path)
+        self.head = ('--%s\r\n'
+                     'Content-Disposition: form-data; name="%s"; filename="%s"\r\n'
+                     'Content-Type: %s\r\n\r\n' % (self.boundary, field, filename or os.path.basename(path),
+                                                   content_type)).encode('utf-8')
+        self.tail = ('\r\n--%s--\r\n' % self.boundary).encode('utf-8')
+        self.stream = open(path, 'rb')
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+        self.parts = [self.head, self.stream, self.tail]
+        self.offset = 0
+
+    @property
+    def content_type(self):
+        return 'multipart/form-data; boundary=%s' % self.boundary
+
+    def __len__(self):
+        return len(self.head) + self.file_size + len(self.tail)
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = len(self)
+
+        chunks = []
+        while size > 0 and self.parts:
+            part = self.parts[0]
+            if part is self.stream:
+                # Never more than the size announced in the Content-Length
+                remaining = self.file_size - self.size
+                data = self.stream.read(min(size, remaining)) if remaining > 0 else b''
+                if not data:
+                    if self.size != self.file_size or self.stream.read(1):
+                        raise IOError("File '%s' changed while it was uploaded" % self.path)
+                    self.parts.pop(0)
+                    continue
+                self.sha256.update(data)
+                self.size += len(data)
+                if self.throttle is not None:
+                    self.throttle.consume(len(data))
+                if self.progress is not None:
+                    self.progress(len(data))
+            else:
+                data = part[self.offset:self.offset + size]
+                self.offset += len(data)
+                if self.offset == len(part):
+                    self.parts.pop(0)
+                    self.offset = 0
+            chunks.append(data)
+            size -= len(data)
+        return b''.join(chunks)
+
+    def checksum(self):
+        return self.sha256.hexdigest()
+
+    def close(self):
+        self.stream.close()
+
+
+class OvaError(Exception):
+    pass
+
+
+MANIFEST_LINE = re.compile(r'^(SHA1|SHA256|SHA512)\s*\((.+)\)\s*=\s*([0-9a-fA-F]+)\s*$')
+
+
+def local_name(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+def parse_ovf_references(data):
+    '''Returns {href: {'size', 'chunked'}} for the files referenced by an OVF descriptor.'''
+    try:
+        root = ElementTree.fromstring(data)
+    except ElementTree.ParseError as ex:
+        raise OvaError("Invalid OVF descriptor: %s" % ex)
+
+    references = {}
+    for element in root:
+        if local_name(element.tag) != 'References':
+            continue
+        for f in element:
+            if local_name(f.tag) != 'File':
+                continue
+            attrs = dict((local_name(k), v) for k, v in f.attrib.items())
+            if 'href' not in attrs:
+                raise OvaError("OVF descriptor has a File without href")
+            references[attrs['href']] = {
+                'size': int(attrs['size']) if 'size' in attrs else None,
+                'chunked': 'chunkSize' in attrs,
+            }
+    return references
+
+
+def parse_manifest(data):
+    digests = {}
+    for line in data.decode('utf-8').splitlines():
+        if not line.strip():
+            continue
+        match = MANIFEST_LINE.match(line.strip())
+        if match is None:
+            raise OvaError("Invalid manifest line: %s" % line.strip())
+        digests[match.group(2)] = (match.group(1).lower(), match.group(3).lower())
+    return digests
+
+
+def hash_chunks(chunks, algorithms):
+    hashes = dict((algorithm, hashlib.new(algorithm)) for algorithm in algorithms)
+    for chunk in chunks:
+        for h in hashes.values():
+            h.update(chunk)
+    return dict((algorithm, h.hexdigest()) for algorithm, h in hashes.items())
+
+
+def read_chunks(f, chunk_size):
+    while True:
+        data = f.read(chunk_size)
+        if not data:
+            return
+        yield data
+
+
+def check_size(references, name, size):
+    reference = references.get(name)
+    if reference is not None and reference['size'] is not None and not reference['chunked'] \
+            and size != reference['size']:
+        raise OvaError("File '%s' is %d bytes, the descriptor says %d" % (name, size, reference['size']))
+
+
+def validate_ova(path, verify_manifest=False, chunk_size=1024 * 1024):
+    '''Checks the structure of an OVA without extracting it.
+
+    The OVF descriptor is parsed and every file it references must be in the
+    archive with the declared size. With verify_manifest, the digests of the
+    .mf manifest are checked too, hashing each file as the archive is read in
+    a single sequential pass. Otherwise the archive is only seeked through.
+    Raises OvaError on the first problem found.
+    '''
+    sizes = {}
+    references = {}
+    descriptor = manifest = None
+    digests = {}
+    computed = {}
+    try:
+        archive = tarfile.open(path, 'r|' if verify_manifest else 'r:')
+        try:
+            for member in archive:
+                if not member.isfile():
+                    continue
+                name = member.name[2:] if member.name.startswith('./') else member.name
+                sizes[name] = member.size
+                if descriptor is None and name.endswith('.ovf'):
+                    descriptor = name
+                    data = archive.extractfile(member).read()
+                    references = parse_ovf_references(data)
+                    for seen, size in sizes.items():
+                        check_size(references, seen, size)
+                    chunks = [data]
+                elif manifest is None and name.endswith('.mf'):
+                    manifest = name
+                    data = archive.extractfile(member).read()
+                    digests = parse_manifest(data)
+                    chunks = [data]
+                else:
+                    check_size(references, name, member.size)
+                    chunks = read_chunks(archive.extractfile(member), chunk_size) if verify_manifest else None
+
+                if verify_manifest:
+                    # Files before the manifest are hashed with every algorithm it may use
+                    if name in digests:
+                        algorithms = [digests[name][0]]
+                    elif manifest is None:
+                        algorithms = ['sha1', 'sha256', 'sha512']
+                    else:
+                        algorithms = []
+                    if algorithms:
+                        computed[name] = hash_chunks(chunks, algorithms)
+        finally:
+            archive.close()
+    except (tarfile.TarError, EOFError) as ex:
+        raise OvaError("'%s' is not a valid OVA: %s" % (path, ex))
+
+    if descriptor is None:
+        raise OvaError("'%s' has no OVF descriptor" % path)
+
+    for href, reference in references.items():
+        if reference['chunked']:
+            chunk_sizes = [size for name, size in sizes.items() if name.startswith(href + '.')]
+            if not chunk_sizes:
+                raise OvaError("File '%s' referenced by the descriptor is missing" % href)
+            if reference['size'] is not None and sum(chunk_sizes) != reference['size']:
+                raise OvaError("Chunks of '%s' are %d bytes, the descriptor says %d" %
+                               (href, sum(chunk_sizes), reference['size']))
+        elif href not in sizes:
+            raise OvaError("File '%s' referenced by the descriptor is missing" % href)
+
+    if verify_manifest:
+        if manifest is None:
+            raise OvaError("'%s' has no manifest to verify" % path)
+        for name, (algorithm, expected) in digests.items():
+            if name not in computed:
+                raise OvaError("File '%s' listed in the manifest is missing" % name)
+            if computed[name][algorithm] != expected:
+                raise OvaError("%s digest of '%s' does not match the manifest" % (algorithm.upper(), name))
+
+    return {
+        'descriptor': descriptor,
+        'manifest': manifest,
+        'files': sorted(references),
+        'verified': sorted(digests) if verify_manifest else [],
+    }
+
+
+class SegmentError(Exception):
+    def __init__(self, message, retryable=False):
+        super(SegmentError, self).__init__(message)
+        self.retryable = retryable
+
+
+class HttpRangeTarget(object):
+    '''Sends each segment in a PUT with a Content-Range header.
+
+    No Abiquo component speaks this protocol: the URL must be a custom
+    receiver that reassembles the file and registers it in the Appliance
+    Manager. The last response is expected to carry the Location of the
+    uploaded template, as the Appliance Manager does for a multipart upload.
+    '''
+
+    def __init__(self, url, auth, verify=False, timeout=None):
+        self.url = url
+        self.auth = auth
+        self.verify = verify
+        self.timeout = timeout
+        self.location = None
+
+    @property
+    def id(self):
+        return 'http:%s' % self.url
+
+    def send(self, offset, data, total):
+        try:
+            response = requests.put(
+                self.url,
+                data=data,
+                auth=self.auth,
+                headers={'Content-Type': 'application/octet-stream',
+                         'Content-Range': 'bytes %d-%d/%d' % (offset, offset + len(data) - 1, total)},
+                verify=self.verify,
+                timeout=self.timeout)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as ex:
+            raise SegmentError(str(ex), retryable=True)
+
+        if response.status_code not in (200, 201, 202, 204, 308):
+            raise SegmentError("Segment at %d rejected: HTTP %s" % (offset, response.status_code),
+                               retryable=response.status_code in (408, 429) or response.status_code >= 500)
+        if 'Location' in response.headers:
+            self.location = response.headers['Location']
+
+    def resumable(self):
+        return True
+
+    def finish(self, total):
+        return self.location
+
+
+class DirectoryTarget(object):
+    '''Writes the segments into a file of a local directory.
+
+    A stand-in for a segment-capable server, to stage OVAs on a share or to
+    exercise resumable uploads offline.
+    '''
+
+    def __init__(self, directory, filename):
+        self.path = os.path.join(directory, filename)
+
+    @property
+    def id(self):
+        return 'dir:%s' % self.path
+
+    def send(self, offset, data, total):
+        try:
+            with open(self.path, 'r+b' if os.path.exists(self.path) else 'wb') as f:
+                f.seek(offset)
+                f.write(data)
+        except (IOError, OSError) as ex:
+            raise SegmentError(str(ex), retryable=True)
+
+    def resumable(self):
+        return os.path.exists(self.path)
+
+    def finish(self, total):
+        with open(self.path, 'r+b') as f:
+            f.truncate(total)
+        return self.path
+
+
+class UploadJournal(object):
+    '''Segments of a file already sent to a target, kept on disk.
+
+    The journal only applies to the same file, segment size and target it
+    was written for, so a changed OVA is uploaded again from the start.
+    '''
+
+    def __init__(self, path, fingerprint):
+        self.path = path
+        self.fingerprint = fingerprint
+        self.done = set()
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                data = json.loads(f.read().decode('utf-8'))
+            if data.get('fingerprint') == fingerprint:
+                self.done = set(data['done'])
+
+    def mark(self, index):
+        self.done.add(index)
+        data = json.dumps({'fingerprint': self.fingerprint, 'done': sorted(self.done)})
+        write_atomically(self.path, data.encode('utf-8'))
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def upload_segmented(path, target, journal_path, segment_size, retries=5, backoff=1.0):
+    '''Uploads a file to target in segments, resuming from the journal.
+
+    Failed segments are retried with exponential backoff. The whole file is
+    read to compute its SHA-256, but only the segments missing from the
+    journal are sent.
+    '''
+    stat = os.stat(path)
+    journal = UploadJournal(journal_path, {
+        'file': os.path.abspath(path),
+        'size': stat.st_size,
+        'mtime': stat.st_mtime,
+        'segment_size': segment_size,
+        'target': target.id,
+    })
+    if not target.resumable():
+        journal.done = set()
+
+    sha256 = hashlib.sha256()
+    resumed = len(journal.done)
+    retried = 0
+    index = 0
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(segment_size)
+            if not data:
+                break
+            sha256.update(data)
+            if index not in journal.done:
+                for attempt in range(retries + 1):
+                    try:
+                        target.send(index * segment_size, data, stat.st_size)
+                        break
+                    except SegmentError as ex:
+                        if not ex.retryable or attempt == retries:
+                            raise
+                        retried += 1
+                        time.sleep(min(backoff * 2 ** attempt, 60))
+                journal.mark(index)
+            index += 1
+
+    result = target.finish(stat.st_size)
+    journal.remove()
+    return {
+        'result': result,
+        'size': stat.st_size,
+        'sha256': sha256.hexdigest(),
+        'segments': index,
+        'resumed_segments': resumed,
+        'retried_segments': retried,
+    }
+
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(chunk_size)
+            if not data:
+                break
+            sha256.update(data)
+    return sha256.hexdigest()
+
+
+class UploadIndex(object):
+    '''Templates created from each OVA, by content hash, enterprise and datacenter.
+
+    It also keeps the hash of each file by path, size and modification time,
+    so unchanged files are not read again to look them up. Every change is
+    merged into the file as it is on disk while holding an exclusive lock on
+    a '.lock' file next to it, so it can be shared by several concurrent runs.
+    '''
+
+    def __init__(self, path):
+        self.path = os.path.expanduser(path)
+        self.lock = threading.Lock()
+
+    def load(self):
+        try:
+            with open(self.path, 'rb') as f:
+                data = json.loads(f.read().decode('utf-8'))
+        except (IOError, OSError, ValueError):
+            data = {}
+        data.setdefault('hashes', {})
+        data.setdefault('templates', {})
+        return data
+
+    def update(self, func):
+        with self.lock:
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.isdir(directory):
+                try:
+                    os.makedirs(directory, 0o700)
+                except OSError:
+                    # Created meanwhile by another run
+                    if not os.path.isdir(directory):
+                        raise
+            with open(self.path + '.lock', 'a') as lock:
+                # Held until the file is closed, other processes wait for it
+                fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+                data = self.load()
+                func(data)
+                write_atomically(self.path, json.dumps(data).encode('utf-8'))
+
+    def file_sha256(self, path):
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        entry = self.load()['hashes'].get(path)
+        if entry is not None and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime:
+            return entry['sha256']
+
+        sha256 = file_sha256(path)
+        self.remember(path, stat, sha256)
+        return sha256
+
+    def remember(self, path, stat, sha256):
+        def update(data):
+            data['hashes'][os.path.abspath(path)] = {'size': stat.st_size, 'mtime': stat.st_mtime, 'sha256': sha256}
+        self.update(update)
+
+    @staticmethod
+    def key(enterprise_id, datacenter_id, sha256):
+        return '%s/%s/%s' % (enterprise_id, datacenter_id, sha256)
+
+    def lookup(self, enterprise_id, datacenter_id, sha256):
+        return self.load()['templates'].get(self.key(enterprise_id, datacenter_id, sha256))
+
+    def record(self, enterprise_id, datacenter_id, sha256, path, template):
+        def update(data):
+            data['templates'][self.key(enterprise_id, datacenter_id, sha256)] = {
+                'template_id': template.id,
+                'template_link': template._extract_link('edit'),
+                'name': template.json.get('name'),
+                'path': os.path.abspath(path),
+                'uploaded_at': time.time(),
+            }
+        self.update(update)
+
+    def forget(self, enterprise_id, datacenter_id, sha256):
+        def update(data):
+            data['templates'].pop(self.key(enterprise_id, datacenter_id, sha256), None)
+        self.update(update)
@@ -1,6 +1,5 @@
-import json
-
 from common import AbiquoCommon
+from common import json_dumps
 from abiquo.client import check_response
 
 
@@ -73,7 +72,7 @@ def create_pcr(region, module):
     c, pcr = common.client.admin.publiccloudregions.post(
         headers={'accept': 'application/vnd.abiquo.publiccloudregion+json',
                  'content-Type': 'application/vnd.abiquo.publiccloudregion+json'},
-        data=json.dumps(pcrjson)
+        data=json_dumps(pcrjson)
     )
     common.check_response(201, c, pcr)
 
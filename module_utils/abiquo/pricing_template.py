@@ -1,6 +1,5 @@
-import json
-
 from common import AbiquoCommon
+from common import json_dumps
 from abiquo.client import check_response
 from ansible.module_utils.abiquo import currency as currencies_module
 
@@ -62,7 +61,7 @@ def create(module):
     code, cur = api.config.pricingtemplates.post(
         headers={'accept': 'application/vnd.abiquo.pricingtemplate+json',
                  'content-Type': 'application/vnd.abiquo.pricingtemplate+json'},
-        data=json.dumps(pricing_template_dict)
+        data=json_dumps(pricing_template_dict)
     )
     check_response(201, code, cur)
 
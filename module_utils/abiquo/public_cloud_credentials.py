@@ -1,6 +1,5 @@
-import json
-
 from common import AbiquoCommon
+from common import json_dumps
 from abiquo.client import check_response
 import enterprise
 
@@ -31,7 +30,7 @@ def add_for_enterprise_and_type(module, enterprise, htype):
             'accept': 'application/vnd.abiquo.publiccloudcredentials+json',
             'content-type': 'application/vnd.abiquo.publiccloudcredentials+json',
         },
-        data=json.dumps(cred_dict)
+        data=json_dumps(cred_dict)
     )
     check_response(201, code, credential)
 
@@ -1,6 +1,5 @@
-import json
-
 from common import AbiquoCommon
+from common import json_dumps
 from abiquo.client import check_response
 import datacenter
 
@@ -70,6 +69,6 @@ def create_machine(rack, module):
     code, machine = rack.follow('machines').post(
         headers={'accept': 'application/vnd.abiquo.machine+json',
                  'content-type': 'application/vnd.abiquo.machine+json'},
-        data=json.dumps(hyp))
+        data=json_dumps(hyp))
     check_response(201, code, machine)
     return machine
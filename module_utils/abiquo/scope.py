@@ -1,7 +1,7 @@
-import json
 import re
 
 from common import AbiquoCommon
+from common import json_dumps
 from common import abiquo_updatable_arguments
 from abiquo.client import check_response
 
@@ -10,10 +10,7 @@ def lookup_by_name(module):
     common = AbiquoCommon(module)
     api = common.client
 
-    code, scopes = api.admin.scopes.get(headers={'accept': 'application/vnd.abiquo.scopes+json'})
-    common.check_response(200, code, scopes)
-
-    for scope in scopes:
+    for scope in api.admin.scopes.iter_collection(headers={'accept': 'application/vnd.abiquo.scopes+json'}):
         if scope.name == module.params.get('name'):
             return scope
 
@@ -38,7 +35,7 @@ def update(module, scope):
     code, scope = scope.follow('edit').put(
         headers={'accept': 'application/vnd.abiquo.scope+json',
                  'content-type': 'application/vnd.abiquo.scope+json'},
-        data=json.dumps(scope.json)
+        data=json_dumps(scope.json)
     )
     common.check_response(200, code, scope)
     return scope
@@ -89,7 +86,7 @@ def create(module):
     code, scope = api.admin.scopes.post(
         headers={'accept': 'application/vnd.abiquo.scope+json',
                  'content-type': 'application/vnd.abiquo.scope+json'},
-        data=json.dumps(scope_json)
+        data=json_dumps(scope_json)
     )
     common.check_response(201, c, scope)
 
@@ -1,5 +1,5 @@
-import json
 from abiquo.client import check_response
+from ansible.module_utils.abiquo.common import json_dumps
 
 
 def create_tags(vm, module):
@@ -10,7 +10,18 @@ def create_tags(vm, module):
             'accept': 'application/vnd.abiquo.asynctask+json',
             'content-Type': 'application/vnd.abiquo.tags+json'
         },
-        data=json.dumps(tags_data)
+        data=json_dumps(tags_data)
     )
     check_response(200, code, tags)
     return tags
+
+
+def get_tags(vm):
+    code, tags = vm.follow('tags').get(headers={'accept': 'application/vnd.abiquo.tags+json'})
+    check_response(200, code, tags)
+
+    if tags is None:
+        return {}
+    if 'collection' in tags.json:
+        return dict((tag['key'], tag['value']) for tag in tags.json['collection'])
+    return dict((k, v) for k, v in tags.json.items() if k != 'links')
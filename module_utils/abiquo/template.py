@@ -1,10 +1,54 @@
-import json
-
 import requests
+import time
 from abiquo.client import check_response
 from ansible.module_utils.abiquo.common import AbiquoCommon
+from ansible.module_utils.abiquo.common import json_dumps
 from ansible.module_utils.abiquo.common import abiquo_updatable_arguments
 from ansible.module_utils.abiquo import datacenter
+from ansible.module_utils.abiquo.ova import MultipartFile
+
+
+def get_vdc_template_catalog(common, vdc_json):
+    '''Templates available in a VDC, indexed by name and ID.
+
+    The catalog is cached; once expired it is revalidated with a conditional
+    GET when it fits in one page, as the ETag only covers the first page.
+    '''
+    key = 'vdc-templates:%s' % common.getLink(vdc_json, 'edit')['href']
+    entry = common.cache.get_entry(key)
+    if entry is not None:
+        return entry['value']
+
+    headers = {'accept': 'application/vnd.abiquo.virtualmachinetemplates+json'}
+    stale = common.cache.get_entry(key, allow_expired=True)
+    if stale is not None and stale.get('etag'):
+        headers['If-None-Match'] = stale['etag']
+
+    code, page = common.client._request('get', common.getLink(vdc_json, 'templates')['href'], headers=headers)
+    if code == 304:
+        common.cache.set(key, stale['value'], etag=stale['etag'])
+        return stale['value']
+    check_response(200, code, page)
+
+    catalog = {'templates': [], 'by_name': {}, 'by_id': {}}
+    for template in page:
+        position = len(catalog['templates'])
+        catalog['templates'].append(template.json)
+        catalog['by_name'].setdefault(template.name, []).append(position)
+        catalog['by_id'][str(template.id)] = position
+
+    common.cache.set(key, catalog, etag=None if page._has_link('next') else page.etag)
+    return catalog
+
+
+def find_in_catalog(catalog, name=None, template_id=None):
+    if template_id is not None:
+        position = catalog['by_id'].get(str(template_id))
+    else:
+        position = (catalog['by_name'].get(name) or [None])[0]
+    if position is None:
+        return None
+    return catalog['templates'][position]
 
 
 def lookup_result(task):
@@ -29,34 +73,95 @@ def update(template, module):
 
 def download(module, datacenter_name, remote_repository_url, template_name):
     common = AbiquoCommon(module)
-    common.login()
 
     dcrepo = datacenter.get_datacenter_repo(datacenter_name, module)
     if dcrepo is None:
         raise Exception('DC repo not found for datacenter %s' % datacenter_name)
 
-    code, enterprise = common.user.follow('enterprise').get()
-    check_response(200, code, enterprise)
-
-    code, remote_repos = enterprise.follow('appslib/templateDefinitionLists').get()
-    check_response(200, code, remote_repos)
-
-    rrepo = filter(lambda x: x.url == remote_repository_url, remote_repos)
-    if len(rrepo) == 0:
-        raise Exception("Remote repo with URL %s not found." % remote_repository_url)
-    rrepo = rrepo[0]
-
-    defs = rrepo.templateDefinitions['collection']
-    template_def = filter(lambda x: x['name'] == template_name, defs)
-    if len(template_def) == 0:
+    template_def = find_template_definition(common, remote_repository_url, template_name,
+                                            module.params.get('refresh_catalog'))
+    if template_def is None:
         raise Exception(
             "Template definition with name %s not found in remote repository %s" %
             (template_name, remote_repository_url))
-    template_def = template_def[0]
+    return request_download(dcrepo, template_def)
+
+
+REMOTE_REPOSITORIES_KEY = 'remote-repositories'
+
+# Scoped keys of the catalogs read from the API in this run, which are not
+# read again when an entry is missing from them.
+_loaded_catalogs = set()
+
+
+def get_remote_repositories(common, refresh=False):
+    '''Remote repositories of the enterprise and their template definitions, indexed by URL and name.
+
+    The catalog is cached, so lookups served from it skip the login, the
+    enterprise and the repositories requests. refresh reads it from the API
+    unless that was already done in this run.
+    '''
+    scoped_key = common.cache.scoped(REMOTE_REPOSITORIES_KEY)
+
+    def load():
+        if common.user is None:
+            common.login()
+        code, enterprise = common.user.follow('enterprise').get()
+        check_response(200, code, enterprise)
+
+        link = enterprise._extract_link('appslib/templateDefinitionLists')
+        code, remote_repos = common.client._request('get', link['href'], headers={'accept': link['type']})
+        check_response(200, code, remote_repos)
+
+        catalog = {'link': link, 'by_url': {}}
+        for rrepo in remote_repos:
+            by_name = {}
+            for template_def in rrepo.templateDefinitions['collection']:
+                by_name.setdefault(template_def['name'], template_def)
+            repository = dict((k, v) for k, v in rrepo.json.items() if k != 'templateDefinitions')
+            catalog['by_url'].setdefault(rrepo.url, {'repository': repository, 'by_name': by_name})
+        _loaded_catalogs.add(scoped_key)
+        return catalog
+
+    if refresh and scoped_key not in _loaded_catalogs:
+        common.cache.invalidate(REMOTE_REPOSITORIES_KEY)
+    return common.cache.get(REMOTE_REPOSITORIES_KEY, load)
+
+
+def invalidate_remote_repositories(common):
+    '''Drops the cached catalog, after adding or removing a remote repository.'''
+    _loaded_catalogs.discard(common.cache.scoped(REMOTE_REPOSITORIES_KEY))
+    common.cache.invalidate(REMOTE_REPOSITORIES_KEY)
+
+
+def find_remote_repository(common, remote_repository_url, refresh=False):
+    '''Returns the catalog entry of a remote repository, with its 'repository' and definitions 'by_name', or None.
+
+    A cached catalog is read again once if it does not have the repository.
+    '''
+    catalog = get_remote_repositories(common, refresh)
+    if remote_repository_url not in catalog['by_url']:
+        catalog = get_remote_repositories(common, refresh=True)
+    return catalog['by_url'].get(remote_repository_url)
+
+
+def find_template_definition(common, remote_repository_url, template_name, refresh=False):
+    '''Returns the template definition with the given name, or None.
+
+    A cached catalog is read again once if it does not have the repository
+    or the definition, which may have been published since.
+    '''
+    catalog = find_remote_repository(common, remote_repository_url, refresh)
+    if catalog is not None and template_name not in catalog['by_name']:
+        catalog = find_remote_repository(common, remote_repository_url, refresh=True)
+    if catalog is None:
+        raise Exception("Remote repo with URL %s not found." % remote_repository_url)
+    return catalog['by_name'].get(template_name)
 
-    template_link = filter(lambda x: x['rel'] == 'edit', template_def['links'])[0]
-    template_link['rel'] = 'templateDefinition'
 
+def request_download(dcrepo, template_def):
+    template_link = dict(next(link for link in template_def['links'] if link['rel'] == 'edit'),
+                         rel='templateDefinition')
     payload = {
         'links': [template_link]
     }
@@ -64,12 +169,51 @@ def download(module, datacenter_name, remote_repository_url, template_name):
     code, download_task = dcrepo.follow('virtualmachinetemplates').post(
         headers={'accept': 'application/vnd.abiquo.acceptedrequest+json',
                  'content-type': 'application/vnd.abiquo.virtualmachinetemplaterequest+json'},
-        data=json.dumps(payload)
+        data=json_dumps(payload)
     )
     check_response(202, code, download_task)
     return download_task
 
 
+def track_tasks(common, tasks, timeout, initial_delay=1, max_delay=15):
+    '''Polls several tasks concurrently until all of them finish or timeout seconds pass.
+
+    Tasks may be given as the accepted requests returned when they were
+    submitted. The delay between rounds doubles up to max_delay. Returns
+    a (task, finished_at, error) tuple per task, in order: finished_at is
+    None for the tasks that did not finish, error the last failure polling
+    them, if any.
+    '''
+    def poll(task):
+        if task._has_link('status'):
+            code, task = task.follow('status').get()
+            check_response(200, code, task)
+            return task
+        return common.get_dto_from_link(dict(task._extract_link('self'), type='application/vnd.abiquo.task+json'))
+
+    current = list(tasks)
+    finished_at = [None] * len(current)
+    errors = [None] * len(current)
+    deadline = time.time() + timeout
+    delay = initial_delay
+    while True:
+        pending = [i for i in range(len(current)) if finished_at[i] is None]
+        for i, (ok, value) in zip(pending, common.bulk_map(poll, [current[i] for i in pending])):
+            if not ok:
+                errors[i] = str(value)
+                continue
+            current[i] = value
+            errors[i] = None
+            if value.state.startswith('FINISHED'):
+                finished_at[i] = time.time()
+
+        remaining = deadline - time.time()
+        if all(f is not None for f in finished_at) or remaining <= 0:
+            return list(zip(current, finished_at, errors))
+        time.sleep(min(delay, remaining))
+        delay = min(delay * 2, max_delay)
+
+
 def search_by_id(dc_repo, template_id):
     code, templates = dc_repo.follow('virtualmachinetemplates').get(
         params={
@@ -91,23 +235,33 @@ def import_template(dc_repo, template):
     code, template = dc_repo.follow('virtualmachinetemplates').post(
         headers={'accept': 'application/vnd.abiquo.virtualmachinetemplate+json',
                  'content-type': 'application/vnd.abiquo.virtualmachinetemplate+json'},
-        data=json.dumps(template.json)
+        data=json_dumps(template.json)
     )
     check_response(201, code, template)
     return template
 
 
-def upload(am_url, api_user, api_pass, enterpriseId, template_file_path):
+def upload(am_url, api_user, api_pass, enterpriseId, template_file_path, timeout=None, throttle=None,
+           progress=None):
+    '''Uploads an OVA to the Appliance Manager, streaming it from disk.
+
+    Returns the response and the MultipartFile body, which holds the size
+    and SHA-256 of the uploaded file.
+    '''
     templates_url = "{}/erepos/{}/templates".format(am_url, enterpriseId)
-    response = requests.post(
-        templates_url,
-        auth=(api_user, api_pass),
-        files={
-            "diskFile": ('file.ova', open(template_file_path, 'rb'), 'application/octet-stream'),
-        },
-        verify=False,
-    )
-    return response
+    body = MultipartFile('diskFile', template_file_path, 'file.ova', throttle=throttle, progress=progress)
+    try:
+        response = requests.post(
+            templates_url,
+            auth=(api_user, api_pass),
+            data=body,
+            headers={'Content-Type': body.content_type},
+            verify=False,
+            timeout=timeout,
+        )
+    finally:
+        body.close()
+    return response, body
 
 def find_template_by_path(api, enterpriseId, template_disk_path, dcrepo_id):
     #find template ID filtering by path (not the same function as the next one)
@@ -115,19 +269,110 @@ def find_template_by_path(api, enterpriseId, template_disk_path, dcrepo_id):
     check_response(200, code, template)
     return template
 
-#It was previously created but it needs template_id, it does not make sense
-def find_by_disk_path(dc_repo, template_id):
-    code, templates = dc_repo.follow('virtualmachinetemplates').get()
+# States a template does not leave without someone acting on it
+TEMPLATE_ERROR_STATES = ('FAILED', 'UNAVAILABLE')
+
+
+def wait_for_template_by_path(api, enterpriseId, template_disk_path, dcrepo_id, timeout=600,
+                              initial_delay=1, max_delay=15):
+    '''Polls the repository until the template with the given disk path is DONE.
+
+    The delay between checks doubles up to max_delay, so small templates are
+    picked up within seconds and big ones do not flood the API. Fails right
+    away if the template is in an error state.
+    '''
+    deadline = time.time() + timeout
+    delay = initial_delay
+    state = None
+    while True:
+        states = []
+        for template in find_template_by_path(api, enterpriseId, template_disk_path, dcrepo_id):
+            state = template.json.get('state')
+            if state == 'DONE':
+                return template
+            states.append(state)
+        failed = [candidate for candidate in states if candidate in TEMPLATE_ERROR_STATES]
+        if failed:
+            raise Exception("Template '%s' is in state %s" % (template_disk_path, failed[0]))
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            raise Exception("Template '%s' not ready after %d seconds (state: %s)" %
+                            (template_disk_path, timeout, state or 'not registered'))
+        time.sleep(min(delay, remaining))
+        delay = min(delay * 2, max_delay)
+
+
+# More templates than this sharing a path means the path filter was ignored
+PATH_FILTER_MAX_CANDIDATES = 5
+
+
+def root_disk_path(template):
+    code, root_disk = template.follow('disk0').get()
+    check_response(200, code, root_disk)
+    return root_disk.path
+
+
+def find_by_disk_path(common, dc_repo, disk_path):
+    '''Finds the template of a repository whose root disk has the given path.
+
+    The templates are filtered by path in the API and the root disk of the
+    candidates is checked. If the filter is not honoured, the lookup goes
+    through an index of the disk paths of the whole repository, built once
+    per cache TTL from the same listing, fetching the disks concurrently.
+    '''
+    code, templates = dc_repo.follow('virtualmachinetemplates').get(
+        params={'path': disk_path},
+        headers={'accept': 'application/vnd.abiquo.virtualmachinetemplates+json'})
     check_response(200, code, templates)
 
-    for template in templates:
-        code, root_disk = template.follow('disk0').get()
-        check_response(200, code, root_disk)
+    # totalSize tells from the first page whether the filter was applied
+    if len(templates) <= PATH_FILTER_MAX_CANDIDATES:
+        for template in templates:
+            if root_disk_path(template) == disk_path:
+                return template
+        return None
 
-        if root_disk.path == template_id:
-            return template
+    index = common.cache.get(disk_path_index_key(dc_repo), lambda: build_disk_path_index(common, templates))
+    link = index.get(disk_path)
+    if link is None:
+        return None
+    code, template = common.client._request('get', link['href'], headers={'accept': link['type']})
+    if code == 404:
+        forget_disk_path(common, dc_repo, disk_path)
+        return None
+    check_response(200, code, template)
+    return template
 
-    return None
+
+def disk_path_index_key(dc_repo):
+    return 'template-disk-paths:%s' % dc_repo._extract_link('virtualmachinetemplates')['href']
+
+
+def build_disk_path_index(common, templates):
+    # Iterating the listing fetches its remaining pages
+    templates = list(templates)
+    index = {}
+    for template, (ok, value) in zip(templates, common.bulk_map(root_disk_path, templates)):
+        if not ok:
+            raise value
+        index[value] = template._extract_link('edit')
+    return index
+
+
+def remember_disk_path(common, dc_repo, disk_path, template):
+    '''Adds a template imported by this run to the cached index, if there is one.'''
+    key = disk_path_index_key(dc_repo)
+    entry = common.cache.get_entry(key)
+    if entry is not None:
+        entry['value'][disk_path] = template._extract_link('edit')
+        common.cache.set(key, entry['value'], stored_at=entry['stored_at'])
+
+
+def forget_disk_path(common, dc_repo, disk_path):
+    key = disk_path_index_key(dc_repo)
+    entry = common.cache.get_entry(key)
+    if entry is not None and entry['value'].pop(disk_path, None) is not None:
+        common.cache.set(key, entry['value'], stored_at=entry['stored_at'])
 
 def remove(api, enterprise_id, datacenter_id, template_id, force_remove):
     code,template_remove = api.admin.enterprises(enterprise_id).datacenterrepositories(datacenter_id).virtualmachinetemplates(template_id).delete()
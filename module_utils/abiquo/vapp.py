@@ -1,15 +1,12 @@
 import time
-import json
 
 from abiquo.client import check_response
 from ansible.module_utils.abiquo.common import AbiquoCommon
+from ansible.module_utils.abiquo.common import json_dumps
 
 
 def find_vapp_in_vdc(vdc, vapp_name):
-    code, vapps = vdc.follow('virtualappliances').get()
-    check_response(200, code, vapps)
-
-    for vapp in vapps:
+    for vapp in vdc.follow('virtualappliances').iter_collection():
         if vapp.name == vapp_name:
             return vapp
     return None
@@ -30,7 +27,7 @@ def create_vapp(module):
     code, vapp = vdc.follow('virtualappliances').post(
         headers={'accept': 'application/vnd.abiquo.virtualappliance+json',
                  'content-Type': 'application/vnd.abiquo.virtualappliance+json'},
-        data=json.dumps(vapp_dict)
+        data=json_dumps(vapp_dict)
     )
     common.check_response(201, code, vapp)
     return vapp
@@ -51,7 +48,7 @@ def deploy_vapp(vapp, module):
     code, deploy_task = vapp.follow('deploy').post(
         headers={'accept': 'application/vnd.abiquo.acceptedrequest+json',
                  'content-Type': 'application/vnd.abiquo.virtualmachinetask+json'},
-        data=json.dumps(request_dict)
+        data=json_dumps(request_dict)
     )
     check_response(202, code, deploy_task)
 
@@ -76,7 +73,7 @@ def undeploy_vapp(vapp, module):
     code, undeploy_task = vapp.follow('undeploy').post(
         headers={'accept': 'application/vnd.abiquo.acceptedrequest+json',
                  'content-Type': 'application/vnd.abiquo.virtualmachinetask+json'},
-        data=json.dumps(request_dict)
+        data=json_dumps(request_dict)
     )
     check_response(202, code, undeploy_task)
 
@@ -99,3 +96,14 @@ def wait_vapp_state(vapp, module):
             time.sleep(delay)
     raise ValueError('Exceeded %s attempts waiting for vApp %s to become %s.' %
                      (attempts, vapp.name, module.params.get('state')))
+
+
+def list_vdc_vapps(common, vdcs):
+    '''Lists the vApps of several VDCs concurrently, in VDC order.'''
+    results = common.bulk_map(lambda vdc: list(vdc.follow('virtualappliances').iter_collection()), vdcs)
+    vapps = []
+    for ok, value in results:
+        if not ok:
+            raise value
+        vapps.extend(value)
+    return vapps
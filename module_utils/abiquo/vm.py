@@ -1,21 +1,79 @@
 import time
-import json
 
 from abiquo.client import check_response
 from ansible.module_utils.abiquo.common import AbiquoCommon
+from ansible.module_utils.abiquo.common import json_dumps
+from ansible.module_utils.abiquo.tag import get_tags
 
 
 def find_vm_in_vdc(vapp, vm_label):
-    code, vms = vapp.follow('virtualmachines').get()
-    check_response(200, code, vms)
-
-    all_vms = []
-    for vm in vms:
+    for vm in vapp.follow('virtualmachines').iter_collection():
         if vm.label == vm_label:
             return vm
     return None
 
 
+def vm_query_params(label=None, params=None, page_size=None):
+    query = dict(params or {})
+    # The label is the only filter the API takes, state and tags are checked
+    # on the controller. 'has' is a substring search, matches are checked
+    # again in vm_matches
+    if label is not None:
+        query['has'] = label
+    if page_size is not None:
+        query['limit'] = page_size
+    return query
+
+
+def vm_matches(vm, label=None, state=None):
+    if label is not None and vm.label != label:
+        return False
+    if state is not None and vm.json.get('state') != state:
+        return False
+    return True
+
+
+def list_vms(vms, params=None):
+    return vms.iter_collection(params=params,
+                               headers={'accept': 'application/vnd.abiquo.virtualmachines+json'})
+
+
+def list_vapp_vms(common, vapps, params=None):
+    '''Lists the VMs of several vApps concurrently, in vApp order.'''
+    results = common.bulk_map(lambda vapp: list(list_vms(vapp.follow('virtualmachines'), params)), vapps)
+    vms = []
+    for ok, value in results:
+        if not ok:
+            raise value
+        vms.extend(value)
+    return vms
+
+
+def filter_vms_by_tags(common, vms, tags, batch_size=100):
+    '''Yields (vm, tags) for the VMs having all the given tags.
+
+    Tags are fetched concurrently for batches of VMs, so a streamed VM
+    collection is not read in full before the first matches are returned.
+    '''
+    batch = []
+    for vm in vms:
+        batch.append(vm)
+        if len(batch) == batch_size:
+            for match in _match_tags(common, batch, tags):
+                yield match
+            batch = []
+    for match in _match_tags(common, batch, tags):
+        yield match
+
+
+def _match_tags(common, vms, tags):
+    for vm, (ok, value) in zip(vms, common.bulk_map(get_tags, vms)):
+        if not ok:
+            raise value
+        if all(k in value and value[k] == str(v) for k, v in tags.items()):
+            yield vm, value
+
+
 def build_vm_links(module):
     links = []
     if module.params.get('hardwareprofile') != None:
@@ -75,7 +133,7 @@ def create_vm(module):
             'accept': 'application/vnd.abiquo.virtualmachine+json',
             'content-type': 'application/vnd.abiquo.virtualmachine+json',
         },
-        data=json.dumps(vm_json)
+        data=json_dumps(vm_json)
     )
     check_response(201, code, vm)
 
@@ -123,22 +181,37 @@ def create_and_deploy_vm(module):
     return vm
 
 
+def get_vapp_vdc_link(common, vapp_link):
+    def load():
+        vapp = common.get_dto_from_link(vapp_link)
+        return vapp._extract_link('virtualdatacenter')
+    return common.cache.get('vapp-vdc:%s' % vapp_link['href'], load)
+
+
+def get_vdc_location_catalog(common, vdc_link):
+    '''Name of the location of a VDC and of its hardware profiles, if it uses them.'''
+    def load():
+        vdc = common.get_dto_from_link(vdc_link)
+        code, location = vdc.follow('location').get()
+        check_response(200, code, location)
+
+        catalog = {'location': location.name, 'hardwareprofiles': None}
+        if location._extract_link('hardwareprofiles') is not None:
+            catalog['hardwareprofiles'] = [h.name for h in location.follow('hardwareprofiles').iter_collection()]
+        return catalog
+    return common.cache.get('vdc-location:%s' % vdc_link['href'], load)
+
+
 def validate_vm_config(module):
     common = AbiquoCommon(module)
 
     ##
     # Validate CPU,RAM vs HP
     #
-    vapp_link = module.params.get('vapp')
-    vapp = common.get_dto_from_link(vapp_link)
-
-    code, vdc = vapp.follow('virtualdatacenter').get()
-    check_response(200, code, vdc)
+    vdc_link = get_vapp_vdc_link(common, module.params.get('vapp'))
+    catalog = get_vdc_location_catalog(common, vdc_link)
 
-    code, location = vdc.follow('location').get()
-    check_response(200, code, vdc)
-
-    if location._extract_link('hardwareprofiles') is not None:
+    if catalog['hardwareprofiles'] is not None:
         ##
         # Need HWprofile
         #
@@ -146,15 +219,11 @@ def validate_vm_config(module):
         if hp is None:
             return "This location requires the use of hardware profiles."
 
-        code, hps = location.follow('hardwareprofiles').get(params={'has': hp['title']})
-        check_response(200, code, hps)
-
-        found = False
-        for h in hps:
-            if h.name == hp['title']:
-                found = True
-
-        if not found:
+        if hp['title'] not in catalog['hardwareprofiles']:
+            # The profile may be newer than the cached catalog
+            common.cache.invalidate('vdc-location:%s' % vdc_link['href'])
+            catalog = get_vdc_location_catalog(common, vdc_link)
+        if hp['title'] not in catalog['hardwareprofiles']:
             return "Hardware profile '%s' does not exist or cannot be found." % hp['title']
 
     ##
@@ -199,7 +268,7 @@ def apply_vm_state(vm, module):
         state_dto = {
             'state': state.upper()
         }
-    code, state_task = vm.follow('state').post(data=json.dumps(state_dto))
+    code, state_task = vm.follow('state').post(data=json_dumps(state_dto))
     check_response(202, code, state_task)
 
     # Wait for the VM to unlock
@@ -0,0 +1,288 @@
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import ansible.module_utils
+MODULE_UTILS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'module_utils')
+if MODULE_UTILS not in ansible.module_utils.__path__:
+    ansible.module_utils.__path__.append(MODULE_UTILS)
+
+from ansible.module_utils.abiquo.facts import ColumnarTable
+from ansible.module_utils.abiquo.facts import compile_fields
+from ansible.module_utils.abiquo.facts import DeltaTracker
+from ansible.module_utils.abiquo.facts import entity_key
+from ansible.module_utils.abiquo.facts import FactsCollector
+from ansible.module_utils.abiquo.facts import LinkExpander
+from ansible.module_utils.abiquo.facts import NdjsonSpool
+from ansible.module_utils.abiquo.facts import project
+
+
+def link(rel, href, title=None):
+    value = {'rel': rel, 'href': href, 'type': 'application/vnd.abiquo.%s+json' % rel}
+    if title is not None:
+        value['title'] = title
+    return value
+
+
+def vm(id, state='ON', hwprofile=None):
+    links = [link('edit', 'http://api/vms/%d' % id), link('virtualmachinetemplate', 'http://api/templates/1')]
+    if hwprofile is not None:
+        links.append(link('hardwareprofile', 'http://api/hwprofiles/%d' % hwprofile, 'hp%d' % hwprofile))
+    return {'id': id, 'name': 'vm%d' % id, 'state': state, 'cpu': 2, 'links': links}
+
+
+class ProjectionTest(unittest.TestCase):
+
+    def test_compile_fields(self):
+        self.assertEqual(None, compile_fields(None))
+        self.assertEqual(None, compile_fields([]))
+        self.assertEqual({'id': {}, 'links': {'edit': {'href': {}}}},
+                         compile_fields(['id', 'links.edit.href']))
+
+    def test_shorter_path_selects_the_whole_value(self):
+        self.assertEqual({'links': {}}, compile_fields(['links.edit.href', 'links']))
+        self.assertEqual({'links': {}}, compile_fields(['links', 'links.edit.href']))
+
+    def test_project_fields(self):
+        entity = vm(1)
+        self.assertEqual({'id': 1, 'state': 'ON'}, project(entity, compile_fields(['id', 'state', 'missing'])))
+        self.assertEqual(entity, project(entity, None))
+
+    def test_project_links_by_rel(self):
+        entity = vm(1, hwprofile=3)
+        self.assertEqual({'links': [link('edit', 'http://api/vms/1')]},
+                         project(entity, compile_fields(['links.edit'])))
+        self.assertEqual({'links': [{'href': 'http://api/vms/1'}, {'title': 'hp3'}]},
+                         project(entity, compile_fields(['links.edit.href', 'links.hardwareprofile.title'])))
+
+    def test_project_list_of_entities(self):
+        value = {'collection': [vm(1), vm(2)]}
+        self.assertEqual({'collection': [{'id': 1}, {'id': 2}]}, project(value, compile_fields(['collection.id'])))
+
+
+class ColumnarTableTest(unittest.TestCase):
+
+    def rebuild(self, result):
+        entities = []
+        for row in result['rows']:
+            entity = {}
+            for column, value in zip(result['columns'], row):
+                if value is None:
+                    continue
+                if column == 'links':
+                    value = [result['links'][i] for i in value]
+                entity[column] = value
+            entities.append(entity)
+        return entities
+
+    def test_round_trip(self):
+        entities = [vm(1, hwprofile=3), vm(2, hwprofile=3), {'id': 3, 'description': 'only here'}]
+        table = ColumnarTable()
+        for entity in entities:
+            table.add(entity)
+        result = table.result()
+        self.assertEqual(entities, self.rebuild(result))
+        self.assertEqual(len(result['columns']), len(set(result['columns'])))
+        self.assertTrue(all(len(row) == len(result['columns']) for row in result['rows']))
+
+    def test_links_are_stored_once(self):
+        table = ColumnarTable()
+        table.add(vm(1, hwprofile=3))
+        table.add(vm(2, hwprofile=3))
+        links = table.result()['links']
+        # Two edit links, and the template and hardware profile shared by both
+        self.assertEqual(4, len(links))
+        self.assertEqual(1, links.count(link('hardwareprofile', 'http://api/hwprofiles/3', 'hp3')))
+
+
+class NdjsonSpoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def spool(self, compress):
+        path = os.path.join(self.directory, 'vms.ndjson')
+        spool = NdjsonSpool(path, compress)
+        self.assertFalse(os.path.exists(path))
+        spool.add(vm(1))
+        spool.add(vm(2))
+        result = spool.close()
+        self.assertEqual(path, result['path'])
+        self.assertEqual(2, result['count'])
+        self.assertEqual([path], [os.path.join(self.directory, name) for name in os.listdir(self.directory)])
+        return result
+
+    def test_plain(self):
+        result = self.spool(False)
+        with open(result['path'], 'rb') as f:
+            data = f.read()
+        self.assertEqual([vm(1), vm(2)], [json.loads(line.decode('utf-8')) for line in data.splitlines()])
+        self.assertEqual(hashlib.sha256(data).hexdigest(), result['checksum'])
+
+    def test_gzip(self):
+        result = self.spool(True)
+        with open(result['path'], 'rb') as f:
+            data = f.read()
+        self.assertEqual(b'\x1f\x8b', data[:2])
+        with gzip.open(result['path'], 'rb') as f:
+            lines = f.read().splitlines()
+        self.assertEqual([vm(1), vm(2)], [json.loads(line.decode('utf-8')) for line in lines])
+        self.assertEqual(hashlib.sha256(data).hexdigest(), result['checksum'])
+
+
+class DeltaTrackerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, 'state.json')
+
+    def run_once(self, entities):
+        tracker = DeltaTracker(self.path)
+        returned = [entity['id'] for entity in entities if tracker.check(entity_key(entity), entity)]
+        return returned, tracker.save()
+
+    def test_first_run_returns_everything(self):
+        returned, delta = self.run_once([vm(1), vm(2)])
+        self.assertEqual([1, 2], returned)
+        self.assertTrue(delta['first_run'])
+        self.assertEqual(['http://api/vms/1', 'http://api/vms/2'], delta['added'])
+        self.assertEqual([], delta['removed'])
+
+    def test_added_changed_and_removed(self):
+        self.run_once([vm(1), vm(2), vm(3)])
+        returned, delta = self.run_once([vm(1), vm(2, state='OFF'), vm(4)])
+        self.assertEqual([2, 4], returned)
+        self.assertFalse(delta['first_run'])
+        self.assertEqual(['http://api/vms/4'], delta['added'])
+        self.assertEqual(['http://api/vms/2'], delta['changed'])
+        self.assertEqual(['http://api/vms/3'], delta['removed'])
+        self.assertEqual(1, delta['unchanged'])
+
+    def test_unchanged_run(self):
+        self.run_once([vm(1), vm(2)])
+        returned, delta = self.run_once([vm(2), vm(1)])
+        self.assertEqual([], returned)
+        self.assertEqual(2, delta['unchanged'])
+
+    def test_entities_are_keyed_by_href(self):
+        self.run_once([vm(1)])
+        moved = vm(1)
+        moved['links'][0]['href'] = 'http://api/other/1'
+        returned, delta = self.run_once([moved])
+        self.assertEqual(['http://api/other/1'], delta['added'])
+        self.assertEqual(['http://api/vms/1'], delta['removed'])
+
+
+class FakeDto(object):
+    def __init__(self, json):
+        self.json = json
+
+
+class FakeCommon(object):
+    def __init__(self, fail=()):
+        self.fail = fail
+        self.fetched = []
+
+    def get_dto_from_link(self, link):
+        self.fetched.append(link['href'])
+        if link['href'] in self.fail:
+            raise Exception('HTTP 404')
+        return FakeDto({'href': link['href'], 'name': link['href'].rsplit('/', 1)[-1]})
+
+    def bulk_map(self, func, items):
+        results = []
+        for item in items:
+            try:
+                results.append((True, func(item)))
+            except Exception as ex:
+                results.append((False, ex))
+        return results
+
+
+class LinkExpanderTest(unittest.TestCase):
+
+    if not hasattr(unittest.TestCase, 'assertRaisesRegex'):
+        assertRaisesRegex = unittest.TestCase.assertRaisesRegexp
+
+    def test_each_href_is_fetched_once(self):
+        common = FakeCommon()
+        expander = LinkExpander(common, ['hardwareprofile', 'virtualmachinetemplate'])
+        entities = [vm(1, hwprofile=3), vm(2, hwprofile=3), vm(3, hwprofile=4)]
+        expander.fetch(value for entity in entities for value in expander.links(entity))
+        expander.fetch(expander.links(vm(4, hwprofile=4)))
+        self.assertEqual(sorted(['http://api/hwprofiles/3', 'http://api/hwprofiles/4', 'http://api/templates/1']),
+                         sorted(common.fetched))
+        self.assertEqual('3', expander.entities['http://api/hwprofiles/3']['name'])
+
+    def test_failed_link(self):
+        expander = LinkExpander(FakeCommon(fail=['http://api/hwprofiles/3']), ['hardwareprofile'])
+        self.assertRaisesRegex(Exception, "Could not expand link 'http://api/hwprofiles/3'",
+                                expander.fetch, expander.links(vm(1, hwprofile=3)))
+
+
+class ExitJson(Exception):
+    pass
+
+
+class FakeModule(object):
+    def __init__(self, **params):
+        self.params = params
+        self.result = None
+
+    def add_cleanup_file(self, path):
+        pass
+
+    def fail_json(self, **result):
+        raise AssertionError(result['msg'])
+
+    def exit_json(self, **result):
+        self.result = result
+        raise ExitJson()
+
+
+class FactsCollectorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def collect(self, entities, **params):
+        module = FakeModule(**params)
+        collector = FactsCollector(module, common=FakeCommon())
+        for entity in entities:
+            collector.add(entity)
+        self.assertRaises(ExitJson, collector.exit_json, 'vms')
+        return module.result
+
+    def test_projection_and_embed(self):
+        result = self.collect([vm(1, hwprofile=3), vm(2, hwprofile=3)], fields=['id'],
+                              expand=['hardwareprofile'], expand_mode='embed')
+        self.assertEqual([{'id': 1, 'expanded': {'hardwareprofile': {'href': 'http://api/hwprofiles/3', 'name': '3'}}},
+                          {'id': 2, 'expanded': {'hardwareprofile': {'href': 'http://api/hwprofiles/3', 'name': '3'}}}],
+                         result['vms'])
+
+    def test_expand_table(self):
+        result = self.collect([vm(1, hwprofile=3)], fields=['id'], expand=['hardwareprofile'], expand_mode='table')
+        self.assertEqual([{'id': 1}], result['vms'])
+        self.assertEqual(['http://api/hwprofiles/3'], list(result['expanded']))
+
+    def test_delta_with_output_file(self):
+        state = os.path.join(self.directory, 'state.json')
+        output = os.path.join(self.directory, 'vms.ndjson')
+        params = dict(fields=['id', 'state', 'links.edit'], since_state=state, output_file=output)
+        self.collect([vm(1), vm(2)], **params)
+        result = self.collect([vm(1), vm(2, state='OFF')], **params)
+        self.assertEqual(1, result['output_file']['count'])
+        self.assertEqual(['http://api/vms/2'], result['delta']['changed'])
+        with open(output, 'rb') as f:
+            self.assertEqual('OFF', json.loads(f.read().decode('utf-8'))['state'])
+
+
+if __name__ == '__main__':
+    unittest.main()
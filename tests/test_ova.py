@@ -0,0 +1,276 @@
+import hashlib
+import io
+import json
+import os
+import shutil
+import tarfile
+import tempfile
+import unittest
+
+import ansible.module_utils
+MODULE_UTILS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'module_utils')
+if MODULE_UTILS not in ansible.module_utils.__path__:
+    ansible.module_utils.__path__.append(MODULE_UTILS)
+
+from ansible.module_utils.abiquo.ova import DirectoryTarget
+from ansible.module_utils.abiquo.ova import MultipartFile
+from ansible.module_utils.abiquo.ova import OvaError
+from ansible.module_utils.abiquo.ova import SegmentError
+from ansible.module_utils.abiquo.ova import upload_segmented
+from ansible.module_utils.abiquo.ova import validate_ova
+
+OVF = '''<?xml version="1.0" encoding="UTF-8"?>
+<Envelope xmlns="http://schemas.dmtf.org/ovf/envelope/1" xmlns:ovf="http://schemas.dmtf.org/ovf/envelope/1">
+  <References>
+    <File ovf:href="disk.vmdk" ovf:id="file1" ovf:size="%d"/>
+  </References>
+</Envelope>
+'''
+
+
+class MultipartFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, 'template.ova')
+        self.data = os.urandom(100000)
+        with open(self.path, 'wb') as f:
+            f.write(self.data)
+
+    def body(self):
+        body = MultipartFile('diskFile', self.path, 'file.ova')
+        self.addCleanup(body.close)
+        return body
+
+    def read_all(self, body):
+        chunks = []
+        while True:
+            data = body.read(8192)
+            if not data:
+                return b''.join(chunks)
+            chunks.append(data)
+
+    def test_body(self):
+        body = self.body()
+        data = self.read_all(body)
+        self.assertEqual(len(body), len(data))
+        self.assertTrue(data.startswith(body.head))
+        self.assertTrue(data.endswith(body.tail))
+        self.assertEqual(self.data, data[len(body.head):-len(body.tail)])
+        self.assertEqual(hashlib.sha256(self.data).hexdigest(), body.checksum())
+
+    def test_file_growing_while_uploaded(self):
+        body = self.body()
+        body.read(8192)
+        with open(self.path, 'ab') as f:
+            f.write(b'more')
+        self.assertRaises(IOError, self.read_all, body)
+        self.assertEqual(len(self.data), body.size)
+
+    def test_file_shrinking_while_uploaded(self):
+        body = self.body()
+        body.read(8192)
+        with open(self.path, 'r+b') as f:
+            f.truncate(50000)
+        self.assertRaises(IOError, self.read_all, body)
+
+
+class RecordingTarget(DirectoryTarget):
+    '''DirectoryTarget that records the segments sent and fails on demand.'''
+
+    def __init__(self, directory, filename, fail_at=None, retryable=False, failures=1):
+        super(RecordingTarget, self).__init__(directory, filename)
+        self.fail_at = fail_at
+        self.retryable = retryable
+        self.failures = failures
+        self.sent = []
+
+    def send(self, offset, data, total):
+        if offset == self.fail_at and self.failures > 0:
+            self.failures -= 1
+            raise SegmentError("Segment at %d failed" % offset, retryable=self.retryable)
+        self.sent.append(offset)
+        super(RecordingTarget, self).send(offset, data, total)
+
+
+class SegmentedUploadTest(unittest.TestCase):
+    SEGMENT = 1024
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.source = os.path.join(self.directory, 'source.ova')
+        # 10 full segments and a partial one
+        data = os.urandom(self.SEGMENT * 10 + 100)
+        with open(self.source, 'wb') as f:
+            f.write(data)
+        self.sha256 = hashlib.sha256(data).hexdigest()
+        self.staging = os.path.join(self.directory, 'staging')
+        os.mkdir(self.staging)
+        self.journal = os.path.join(self.directory, 'source.ova.upload.json')
+
+    def upload(self, target, **kwargs):
+        return upload_segmented(self.source, target, self.journal, self.SEGMENT, backoff=0, **kwargs)
+
+    def staged_sha256(self):
+        with open(os.path.join(self.staging, 'source.ova'), 'rb') as f:
+            return hashlib.sha256(f.read()).hexdigest()
+
+    def test_upload_in_one_run(self):
+        target = RecordingTarget(self.staging, 'source.ova')
+        result = self.upload(target)
+        self.assertEqual([i * self.SEGMENT for i in range(11)], target.sent)
+        self.assertEqual(11, result['segments'])
+        self.assertEqual(0, result['resumed_segments'])
+        self.assertEqual(self.sha256, result['sha256'])
+        self.assertEqual(self.sha256, self.staged_sha256())
+        self.assertFalse(os.path.exists(self.journal))
+
+    def test_rerun_only_sends_missing_segments(self):
+        failing = RecordingTarget(self.staging, 'source.ova', fail_at=4 * self.SEGMENT)
+        self.assertRaises(SegmentError, self.upload, failing)
+        self.assertEqual([i * self.SEGMENT for i in range(4)], failing.sent)
+        with open(self.journal, 'rb') as f:
+            self.assertEqual([0, 1, 2, 3], json.loads(f.read().decode('utf-8'))['done'])
+
+        target = RecordingTarget(self.staging, 'source.ova')
+        result = self.upload(target)
+        self.assertEqual([i * self.SEGMENT for i in range(4, 11)], target.sent)
+        self.assertEqual(4, result['resumed_segments'])
+        self.assertEqual(self.sha256, result['sha256'])
+        self.assertEqual(self.sha256, self.staged_sha256())
+        self.assertFalse(os.path.exists(self.journal))
+
+    def test_changed_file_is_sent_again(self):
+        failing = RecordingTarget(self.staging, 'source.ova', fail_at=4 * self.SEGMENT)
+        self.assertRaises(SegmentError, self.upload, failing)
+        with open(self.source, 'ab') as f:
+            f.write(b'more')
+        os.utime(self.source, (0, 0))
+        with open(self.source, 'rb') as f:
+            sha256 = hashlib.sha256(f.read()).hexdigest()
+
+        target = RecordingTarget(self.staging, 'source.ova')
+        result = self.upload(target)
+        self.assertEqual(0, result['resumed_segments'])
+        self.assertEqual(11, len(target.sent))
+        self.assertEqual(sha256, self.staged_sha256())
+
+    def test_missing_target_file_is_sent_again(self):
+        failing = RecordingTarget(self.staging, 'source.ova', fail_at=4 * self.SEGMENT)
+        self.assertRaises(SegmentError, self.upload, failing)
+        os.remove(os.path.join(self.staging, 'source.ova'))
+
+        target = RecordingTarget(self.staging, 'source.ova')
+        result = self.upload(target)
+        self.assertEqual(0, result['resumed_segments'])
+        self.assertEqual(11, len(target.sent))
+        self.assertEqual(self.sha256, self.staged_sha256())
+
+    def test_retryable_failure_is_retried(self):
+        target = RecordingTarget(self.staging, 'source.ova', fail_at=2 * self.SEGMENT, retryable=True, failures=2)
+        result = self.upload(target)
+        self.assertEqual(2, result['retried_segments'])
+        self.assertEqual([i * self.SEGMENT for i in range(11)], target.sent)
+        self.assertEqual(self.sha256, self.staged_sha256())
+
+    def test_retries_are_bounded(self):
+        target = RecordingTarget(self.staging, 'source.ova', fail_at=2 * self.SEGMENT, retryable=True, failures=10)
+        self.assertRaises(SegmentError, self.upload, target, retries=3)
+        self.assertEqual(6, target.failures)
+        self.assertEqual([0, self.SEGMENT], target.sent)
+
+
+class ValidateOvaTest(unittest.TestCase):
+    DISK = b'disk contents' * 1000
+
+    if not hasattr(unittest.TestCase, 'assertRaisesRegex'):
+        assertRaisesRegex = unittest.TestCase.assertRaisesRegexp
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def write_ova(self, members):
+        path = os.path.join(self.directory, 'template.ova')
+        archive = tarfile.open(path, 'w')
+        for name, data in members:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+        archive.close()
+        return path
+
+    def members(self, declared_size=None, disk=None, digest=None):
+        disk = self.DISK if disk is None else disk
+        ovf = (OVF % (len(self.DISK) if declared_size is None else declared_size)).encode('utf-8')
+        manifest = ('SHA256(template.ovf)= %s\nSHA256(disk.vmdk)= %s\n' % (
+            hashlib.sha256(ovf).hexdigest(), digest or hashlib.sha256(disk).hexdigest())).encode('utf-8')
+        return ('template.ovf', ovf), ('template.mf', manifest), ('disk.vmdk', disk)
+
+    def test_structure_of_good_ova(self):
+        ovf, manifest, disk = self.members()
+        result = validate_ova(self.write_ova([ovf, manifest, disk]))
+        self.assertEqual('template.ovf', result['descriptor'])
+        self.assertEqual('template.mf', result['manifest'])
+        self.assertEqual(['disk.vmdk'], result['files'])
+        self.assertEqual([], result['verified'])
+
+    def test_manifest_before_files(self):
+        ovf, manifest, disk = self.members()
+        result = validate_ova(self.write_ova([ovf, manifest, disk]), verify_manifest=True)
+        self.assertEqual(['disk.vmdk', 'template.ovf'], result['verified'])
+
+    def test_manifest_after_files(self):
+        ovf, manifest, disk = self.members()
+        result = validate_ova(self.write_ova([ovf, disk, manifest]), verify_manifest=True, chunk_size=1000)
+        self.assertEqual(['disk.vmdk', 'template.ovf'], result['verified'])
+
+    def test_bad_digest(self):
+        ovf, manifest, disk = self.members(digest='0' * 64)
+        for members in ([ovf, manifest, disk], [ovf, disk, manifest]):
+            path = self.write_ova(members)
+            self.assertRaisesRegex(OvaError, "SHA256 digest of 'disk.vmdk'", validate_ova, path,
+                                    verify_manifest=True)
+
+    def test_corrupted_disk(self):
+        ovf, manifest, disk = self.members(disk=b'x' * len(self.DISK), digest=hashlib.sha256(self.DISK).hexdigest())
+        path = self.write_ova([ovf, manifest, disk])
+        # The structure is fine, only the manifest catches it
+        validate_ova(path)
+        self.assertRaises(OvaError, validate_ova, path, verify_manifest=True)
+
+    def test_size_mismatch(self):
+        ovf, manifest, disk = self.members(declared_size=len(self.DISK) + 1)
+        for members in ([ovf, manifest, disk], [disk, manifest, ovf]):
+            path = self.write_ova(members)
+            self.assertRaisesRegex(OvaError, "'disk.vmdk' is %d bytes" % len(self.DISK), validate_ova, path)
+
+    def test_missing_referenced_file(self):
+        ovf, manifest, disk = self.members()
+        path = self.write_ova([ovf, manifest])
+        self.assertRaisesRegex(OvaError, "'disk.vmdk' referenced by the descriptor is missing", validate_ova, path)
+
+    def test_missing_ovf(self):
+        ovf, manifest, disk = self.members()
+        path = self.write_ova([manifest, disk])
+        self.assertRaisesRegex(OvaError, "has no OVF descriptor", validate_ova, path)
+        self.assertRaisesRegex(OvaError, "has no OVF descriptor", validate_ova, path, verify_manifest=True)
+
+    def test_missing_manifest(self):
+        ovf, manifest, disk = self.members()
+        path = self.write_ova([ovf, disk])
+        validate_ova(path)
+        self.assertRaisesRegex(OvaError, "has no manifest", validate_ova, path, verify_manifest=True)
+
+    def test_not_a_tar_file(self):
+        path = os.path.join(self.directory, 'template.ova')
+        with open(path, 'wb') as f:
+            f.write(os.urandom(4096))
+        self.assertRaisesRegex(OvaError, "is not a valid OVA", validate_ova, path)
+        self.assertRaisesRegex(OvaError, "is not a valid OVA", validate_ova, path, verify_manifest=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,143 @@
+import os
+import unittest
+import uuid
+
+import ansible.module_utils
+MODULE_UTILS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'module_utils')
+if MODULE_UTILS not in ansible.module_utils.__path__:
+    ansible.module_utils.__path__.append(MODULE_UTILS)
+
+from ansible.module_utils.abiquo import template as template_module
+from ansible.module_utils.abiquo.cache import Cache
+
+
+class FakeResponse(object):
+    def __init__(self, value):
+        self.value = value
+
+    def get(self, params=None, headers=None):
+        return 200, self.value
+
+
+class FakeTemplate(object):
+    def __init__(self, repo, id, path):
+        self.repo = repo
+        self.id = id
+        self.path = path
+        self.json = {'id': id}
+
+    def follow(self, rel):
+        self.repo.disk_requests.append(self.id)
+        return FakeResponse(self)
+
+    def _extract_link(self, rel):
+        return {'rel': rel, 'href': 'http://api/templates/%d' % self.id, 'type': 'template'}
+
+
+class FakeListing(object):
+    '''Paged listing, counting the templates read from it.'''
+
+    def __init__(self, repo, templates):
+        self.repo = repo
+        self.templates = templates
+
+    def __len__(self):
+        return len(self.templates)
+
+    def __iter__(self):
+        for template in self.templates:
+            self.repo.listed += 1
+            yield template
+
+
+class FakeRepository(object):
+    def __init__(self, paths, honour_filter):
+        self.templates = [FakeTemplate(self, i, path) for i, path in enumerate(paths)]
+        self.honour_filter = honour_filter
+        self.listed = 0
+        self.listings = 0
+        self.disk_requests = []
+
+    def follow(self, rel):
+        return self
+
+    def get(self, params=None, headers=None):
+        self.listings += 1
+        templates = self.templates
+        if self.honour_filter:
+            templates = [t for t in templates if t.path == params['path']]
+        return 200, FakeListing(self, templates)
+
+    def _extract_link(self, rel):
+        return {'rel': rel, 'href': 'http://api/repo/templates'}
+
+
+class FakeClient(object):
+    def __init__(self, repo):
+        self.repo = repo
+        self.deleted = set()
+
+    def _request(self, method, href, headers=None):
+        id = int(href.rsplit('/', 1)[-1])
+        if id in self.deleted:
+            return 404, None
+        return 200, self.repo.templates[id]
+
+
+class FakeCommon(object):
+    def __init__(self, repo):
+        self.client = FakeClient(repo)
+        self.cache = Cache(uuid.uuid4().hex)
+
+    def bulk_map(self, func, items):
+        return [(True, func(item)) for item in items]
+
+
+class FindByDiskPathTest(unittest.TestCase):
+
+    def test_filtered_lookup(self):
+        repo = FakeRepository(['a/%d.vmdk' % i for i in range(50)], honour_filter=True)
+        common = FakeCommon(repo)
+        self.assertEqual(7, template_module.find_by_disk_path(common, repo, 'a/7.vmdk').id)
+        self.assertEqual(None, template_module.find_by_disk_path(common, repo, 'a/new.vmdk'))
+        self.assertEqual([7], repo.disk_requests)
+        self.assertEqual(1, repo.listed)
+
+    def test_small_repository_without_filter(self):
+        repo = FakeRepository(['a/%d.vmdk' % i for i in range(3)], honour_filter=False)
+        common = FakeCommon(repo)
+        self.assertEqual(None, template_module.find_by_disk_path(common, repo, 'a/new.vmdk'))
+        self.assertEqual([0, 1, 2], repo.disk_requests)
+
+    def test_ignored_filter_lists_the_repository_once(self):
+        repo = FakeRepository(['a/%d.vmdk' % i for i in range(50)], honour_filter=False)
+        common = FakeCommon(repo)
+        self.assertEqual(7, template_module.find_by_disk_path(common, repo, 'a/7.vmdk').id)
+        self.assertEqual(50, repo.listed)
+        self.assertEqual(50, len(repo.disk_requests))
+
+        # Misses, the usual case before importing a template, use the same index
+        self.assertEqual(None, template_module.find_by_disk_path(common, repo, 'a/new.vmdk'))
+        self.assertEqual(3, template_module.find_by_disk_path(common, repo, 'a/3.vmdk').id)
+        self.assertEqual(3, repo.listings)
+        self.assertEqual(50, repo.listed)
+        self.assertEqual(50, len(repo.disk_requests))
+
+    def test_imported_and_deleted_templates_update_the_index(self):
+        repo = FakeRepository(['a/%d.vmdk' % i for i in range(50)], honour_filter=False)
+        common = FakeCommon(repo)
+        self.assertEqual(None, template_module.find_by_disk_path(common, repo, 'a/new.vmdk'))
+
+        repo.templates.append(FakeTemplate(repo, 50, 'a/new.vmdk'))
+        template_module.remember_disk_path(common, repo, 'a/new.vmdk', repo.templates[50])
+        self.assertEqual(50, template_module.find_by_disk_path(common, repo, 'a/new.vmdk').id)
+
+        common.client.deleted.add(7)
+        self.assertEqual(None, template_module.find_by_disk_path(common, repo, 'a/7.vmdk'))
+        entry = common.cache.get_entry(template_module.disk_path_index_key(repo))
+        self.assertFalse('a/7.vmdk' in entry['value'])
+        self.assertEqual(50, len(repo.disk_requests))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,146 @@
+import os
+import threading
+import time
+import unittest
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+import ansible.module_utils
+MODULE_UTILS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'module_utils')
+if MODULE_UTILS not in ansible.module_utils.__path__:
+    ansible.module_utils.__path__.append(MODULE_UTILS)
+
+from ansible.module_utils.abiquo.bulk import AimdLimiter
+from ansible.module_utils.abiquo.bulk import bulk_map
+from ansible.module_utils.abiquo.common import AbiquoTransport
+from ansible.module_utils.abiquo.common import add_request_listener
+from ansible.module_utils.abiquo.common import remove_request_listener
+
+
+class ThrottlingServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, capacity, status=429):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), ThrottlingHandler)
+        self.capacity = capacity
+        self.status = status
+        self.active = 0
+        self.requests = []
+        self.lock = threading.Lock()
+        # Paths answered with `status` the first time they are requested
+        self.fail_once = set()
+
+
+class ThrottlingHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def handle_one(self):
+        server = self.server
+        with server.lock:
+            server.requests.append((self.command, self.path))
+            server.active += 1
+            throttled = server.active > server.capacity or self.path in server.fail_once
+            server.fail_once.discard(self.path)
+        try:
+            time.sleep(0.01)
+            if throttled:
+                self.reply(server.status, b'{"collection": [{"code": "X", "message": "busy"}]}', {'Retry-After': '0'})
+            else:
+                self.reply(200, b'{"links": []}')
+        finally:
+            with server.lock:
+                server.active -= 1
+
+    def reply(self, status, body, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.handle_one()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.handle_one()
+
+
+class TransportRetryTest(unittest.TestCase):
+
+    def start(self, capacity=1000, status=429):
+        server = ThrottlingServer(capacity, status)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return server, 'http://127.0.0.1:%d' % server.server_address[1]
+
+    def test_throttled_request_succeeds_on_retry(self):
+        server, url = self.start()
+        server.fail_once.add('/item')
+        response = AbiquoTransport(retries=3).request('get', url + '/item')
+        self.assertEqual(200, response.status_code)
+        self.assertEqual([('GET', '/item'), ('GET', '/item')], server.requests)
+
+    def test_throttled_post_is_retried(self):
+        server, url = self.start(status=429)
+        server.fail_once.add('/item')
+        response = AbiquoTransport(retries=3).request('post', url + '/item', data='{}')
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(2, len(server.requests))
+
+    def test_unavailable_post_is_not_retried(self):
+        server, url = self.start(status=503)
+        server.fail_once.add('/item')
+        response = AbiquoTransport(retries=3).request('post', url + '/item', data='{}')
+        self.assertEqual(503, response.status_code)
+        self.assertEqual(1, len(server.requests))
+
+    def test_unavailable_get_is_retried(self):
+        server, url = self.start(status=503)
+        server.fail_once.add('/item')
+        response = AbiquoTransport(retries=3).request('get', url + '/item')
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(2, len(server.requests))
+
+    def test_server_error_on_post_is_not_retried(self):
+        server, url = self.start(status=500)
+        server.fail_once.add('/item')
+        response = AbiquoTransport(retries=3).request('post', url + '/item', data='{}')
+        self.assertEqual(500, response.status_code)
+        self.assertEqual(1, len(server.requests))
+
+    def test_retries_are_bounded(self):
+        server, url = self.start(capacity=0)
+        response = AbiquoTransport(retries=2).request('get', url + '/item')
+        self.assertEqual(429, response.status_code)
+        self.assertEqual(3, len(server.requests))
+
+    def test_bulk_map_survives_throttling(self):
+        server, url = self.start(capacity=6)
+        transport = AbiquoTransport(pool_size=32, retries=5)
+        limiter = AimdLimiter(initial=16, maximum=32)
+        add_request_listener(limiter.observe)
+        try:
+            results = bulk_map(lambda i: transport.request('get', '%s/item/%d' % (url, i)).status_code,
+                               range(300), limiter)
+        finally:
+            remove_request_listener(limiter.observe)
+        self.assertEqual([(True, 200)] * 300, results)
+        self.assertTrue(len(server.requests) > 300)
+
+
+if __name__ == '__main__':
+    unittest.main()